@@ -1,8 +1,58 @@
 import streamlit as st
-from PIL import Image
-import io
-import zipfile
-import base64
+import os
+import tempfile
+
+from encoders import FORMATS, encode_image, extension, mime_type
+from image_cache import decode_cache
+from compositor import composite_batch, composite_parallel, composite_preview, load_proxy, preview_sizes, write_zip
+
+THUMBNAIL_SIZE = 256
+
+
+def get_proxy(file):
+    # 每个上传文件只生成一次缩小的代理图像，跨重新运行缓存在会话中
+    cache = st.session_state.setdefault("proxies", {})
+    if file.file_id not in cache:
+        cache[file.file_id] = load_proxy(file, THUMBNAIL_SIZE)
+        file.seek(0)
+    return cache[file.file_id]
+
+
+def get_thumbnail(background_file, foreground_file, background_size):
+    cache = st.session_state.setdefault("thumbnails", {})
+    key = (background_file.file_id, foreground_file.file_id, background_size)
+    if key not in cache:
+        cache[key] = composite_preview(get_proxy(background_file), background_size,
+                                       get_proxy(foreground_file), THUMBNAIL_SIZE)
+    return cache[key]
+
+
+def show_previews(uploaded_backgrounds, uploaded_foregrounds):
+    """
+    分页显示合成结果的缩略图，只生成当前页需要的缩略图
+    """
+    file_ids = {f.file_id for f in uploaded_backgrounds + uploaded_foregrounds}
+    # 清理已经不在上传列表中的缓存
+    st.session_state["proxies"] = {k: v for k, v in st.session_state.get("proxies", {}).items() if k in file_ids}
+    st.session_state["thumbnails"] = {k: v for k, v in st.session_state.get("thumbnails", {}).items()
+                                      if k[0] in file_ids and k[1] in file_ids}
+
+    total = len(uploaded_backgrounds) * len(uploaded_foregrounds)
+    col1, col2 = st.columns(2)
+    page_size = col1.selectbox("每页数量", (12, 24, 48))
+    pages = (total + page_size - 1) // page_size
+    page = col2.number_input(f"页码（共 {pages} 页）", min_value=1, max_value=pages, value=1)
+
+    indexes = range((page - 1) * page_size, min(page * page_size, total))
+    columns = st.columns(4)
+    for k, index in enumerate(indexes):
+        i, j = divmod(index, len(uploaded_foregrounds))
+        background_file = uploaded_backgrounds[i]
+        foreground_sizes = [get_proxy(f)["size"] for f in uploaded_foregrounds[:j + 1]]
+        *_, background_size = preview_sizes(get_proxy(background_file)["size"], foreground_sizes)
+        thumbnail = get_thumbnail(background_file, uploaded_foregrounds[j], background_size)
+        columns[k % 4].image(thumbnail, caption=f"合成图像 {index+1}")
+
 
 def main():
     st.set_page_config(page_title="图像合成", page_icon="🎨", layout="wide", initial_sidebar_state="collapsed")
@@ -13,52 +63,48 @@ def main():
     uploaded_foregrounds = st.file_uploader("上传前景图像（可以多选）", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
     uploaded_backgrounds = st.file_uploader("上传背景图像（可以多选）", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
 
-    if st.button("生成并下载图像"):
-        if uploaded_foregrounds and uploaded_backgrounds:
-            output_images = []
-
-            for i, background_file in enumerate(uploaded_backgrounds):
-                background = Image.open(background_file).convert("RGBA")
+    if uploaded_foregrounds and uploaded_backgrounds:
+        show_previews(uploaded_backgrounds, uploaded_foregrounds)
 
-                for j, foreground_file in enumerate(uploaded_foregrounds):
-                    foreground = Image.open(foreground_file).convert("RGBA")
-                    # 如果前景图像比背景图像大，将背景图像扩展到和前景图像一样的大小
-                    if foreground.width > background.width or foreground.height > background.height:
-                        background = background.resize((foreground.width, foreground.height), Image.BICUBIC)
-                        # background = Image.effect_mandelbrot(background.size, (0, 0, background.width // 2, background.height // 2), 32)
+    col1, col2, col3 = st.columns(3)
+    workers = col1.number_input("并行线程数", min_value=1, max_value=64, value=os.cpu_count() or 1)
+    output_format = col2.selectbox("输出格式", list(FORMATS))
+    preset = col3.selectbox("编码预设", ("default", "fast", "small"))
+    encoder = {"format": output_format, "preset": preset}
+    ext = extension(output_format)
 
-                    composite_image = Image.new("RGBA", background.size)
-                    composite_image.paste(background, (0, 0))
-
-                    # 计算前景图像的位置，使其在背景图像上居中
-                    position = ((background.width - foreground.width) // 2, (background.height - foreground.height) // 2)
-                    composite_image.alpha_composite(foreground, position)
-
-                    output_images.append(composite_image)
-            
-            for i, img in enumerate(output_images):
-                st.image(img, caption=f"合成图像 {i+1}")
+    if st.button("生成并下载图像"):
+        if uploaded_foregrounds and uploaded_backgrounds:
+            total = len(uploaded_backgrounds) * len(uploaded_foregrounds)
 
-            if len(output_images) == 1:
+            if total == 1:
                 # 如果只有一张图像，并且正在运行在移动设备上，则直接下载图像，而不是打包成ZIP文件
-                with io.BytesIO() as buffer:
-                    output_images[0].save(buffer, format="PNG")
-                    buffer.seek(0)
-                    b64 = base64.b64encode(buffer.getvalue()).decode()
-                    href = f'<a href="data:image/png;base64,{b64}" download="合成图像.png">点击下载合成图像</a>'
-                    st.markdown(href, unsafe_allow_html=True)
-            elif len(output_images) > 0:              
-                #将它们打包成一个ZIP文件，并提供一个链接以便下载
-                with io.BytesIO() as buffer:
-                    with zipfile.ZipFile(buffer, "w") as zip_file:
-                        for i, img in enumerate(output_images):
-                            img_bytes = io.BytesIO()
-                            img.save(img_bytes, format="PNG")
-                            zip_file.writestr(f"合成图像 {i+1}.png", img_bytes.getvalue())
-                    buffer.seek(0)
-                    b64 = base64.b64encode(buffer.getvalue()).decode()
-                    href = f'<a href="data:application/zip;base64,{b64}" download="合成图像.zip">点击下载所有合成图像</a>'
-                    st.markdown(href, unsafe_allow_html=True)
+                img = next(composite_batch(uploaded_backgrounds, uploaded_foregrounds))
+                data, stats = encode_image(img, **encoder)
+                st.caption(f"编码 {stats['time']:.2f}s · 大小 {stats['size'] / 1024:.1f} KB")
+                st.download_button("点击下载合成图像", data=data, file_name=f"合成图像.{ext}",
+                                   mime=mime_type(output_format), on_click="ignore")
+            else:
+                # 全分辨率图像只在下载时生成，多线程并行合成和编码，每生成一张就按顺序写入临时ZIP文件并释放，合成和编码的内存占用不随图像数量增长
+                timings = {}
+                encoded_images = composite_parallel(uploaded_backgrounds, uploaded_foregrounds, workers, timings, encoder)
+                # download_button 只接受 BufferedReader 等类型，先写入有名字的临时文件，再以 "rb" 重新打开交给它；
+                # 下载按钮仍会把整个ZIP读入媒体文件管理器的内存，读入后即可删除临时文件
+                archive = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+                try:
+                    with archive:
+                        write_zip(encoded_images, archive, name_format=f"合成图像 {{}}.{ext}")
+                    st.caption(f"解码 {timings['decode']:.2f}s · 合成 {timings['composite']:.2f}s · "
+                               f"编码 {timings['encode']:.2f}s · 总耗时 {timings['total']:.2f}s（{workers} 线程）· "
+                               f"输出 {timings['bytes'] / 1024 / 1024:.1f} MB")
+                    cache_stats = decode_cache.stats()
+                    st.caption(f"解码缓存命中 {cache_stats['hits']} 次 · 未命中 {cache_stats['misses']} 次 · "
+                               f"占用 {cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+                    with open(archive.name, "rb") as data:
+                        st.download_button("点击下载所有合成图像", data=data, file_name="合成图像.zip",
+                                           mime="application/zip", on_click="ignore")
+                finally:
+                    os.remove(archive.name)
         else:
             st.warning("请确保已经上传前景图像和背景图像组。")
 
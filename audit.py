@@ -1,15 +1,21 @@
 import streamlit as st
-import requests
+import functools
 import json
-import pandas as pd
-import PyPDF2
 import io
 import os
 import datetime
 from io import StringIO
 import re
+import threading
 import time
 
+from audit_cache import findings_cache, result_cache
+from audit_engine import APIError, RequestLimiter, audit_map_reduce, audit_sections, build_audit_prompt, chat_completion
+from audit_extract import extract_docx_text, extract_pdf_pages, extract_xlsx_pages
+from audit_jobs import JobQueue
+from audit_store import AuditStore
+from kb_index import BM25Index
+
 # 设置页面配置
 st.set_page_config(
     page_title="AI合规审核工具",
@@ -21,16 +27,211 @@ st.set_page_config(
 st.title("⚖️ AI合规审核工具")
 st.markdown("---")
 
-# 初始化会话状态
-if 'knowledge_base' not in st.session_state:
-    st.session_state.knowledge_base = {
-        "法律法规": [],
-        "区域政策": [],
-        "行业标准": []
-    }
+# 知识库和审核历史保存在 SQLite 中，所有会话共享，位置可通过 AUDIT_DB_PATH 调整
+KB_CATEGORIES = ["法律法规", "区域政策", "行业标准"]
+PAGE_SIZE = 20
+
+
+@st.cache_resource
+def get_store():
+    return AuditStore(os.getenv("AUDIT_DB_PATH", "audit.sqlite3"))
+
+
+def knowledge_text(entry):
+    return " ".join(entry.get(field) or "" for field in ("title", "category", "region", "description"))
+
+
+@st.cache_resource
+def get_kb_index(_store):
+    """
+    每个类别一个 BM25 检索索引，启动时从数据库构建，之后随知识库的增删增量更新。
+    返回 (类别到索引的映射, 条目编号到索引内编号的映射, 锁)。
+    索引由所有会话和后台任务共享，增删和检索都要持有锁
+    """
+    indexes = {category: BM25Index() for category in KB_CATEGORIES}
+    doc_ids = {}
+    for entry in _store.iter_knowledge():
+        doc_ids[entry["id"]] = indexes[entry["kind"]].add(knowledge_text(entry), entry)
+    return indexes, doc_ids, threading.Lock()
+
+
+store = get_store()
+kb_index, kb_doc_ids, kb_lock = get_kb_index(store)
+
+
+def add_knowledge(category, entry):
+    entry["id"] = store.add_knowledge(category, entry)
+    entry["kind"] = category
+    with kb_lock:
+        kb_doc_ids[entry["id"]] = kb_index[category].add(knowledge_text(entry), entry)
+
+
+def remove_knowledge(entry):
+    store.delete_knowledge(entry["id"])
+    with kb_lock:
+        # 其他会话可能已经删除了同一条目
+        doc_id = kb_doc_ids.pop(entry["id"], None)
+        if doc_id is not None:
+            kb_index[entry["kind"]].remove(doc_id)
+
+
+def page_selector(total, key):
+    """
+    显示页码选择并返回当前页的偏移量，结果变少时自动回到最后一页
+    """
+    pages = max(1, -(-total // PAGE_SIZE))
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"页码（共 {pages} 页，{total} 条）", min_value=1, max_value=pages, key=key)
+    return (page - 1) * PAGE_SIZE
+
+
+def stream_to(placeholder, interval=0.1):
+    """
+    返回流式输出的回调，把收到的文本累积后渲染到 placeholder，最多每 interval 秒刷新一次
+    """
+    parts = []
+    last_render = 0.0
+
+    def on_token(delta):
+        nonlocal last_render
+        parts.append(delta)
+        now = time.perf_counter()
+        if now - last_render >= interval:
+            placeholder.markdown("".join(parts) + "▌")
+            last_render = now
+
+    return on_token
+
+
+def load_documents(uploaded_files, input_text):
+    """
+    提取上传文件和输入文本，每个文档为 (名称, [每页文本])，分块时沿页边界切分
+    """
+    documents = []
+    
+    if uploaded_files:
+        for file in uploaded_files:
+            if file.name.endswith('.pdf'):
+                # 多进程按页并行提取，并按 (文件哈希, 页码) 缓存
+                documents.append((f"PDF文件 '{file.name}'", extract_pdf_pages(file.getvalue())))
+                
+            elif file.name.endswith('.xlsx'):
+                # 逐行读取所有工作表，每个工作表一页紧凑的 CSV
+                documents.append((f"Excel文件 '{file.name}'", extract_xlsx_pages(file.getvalue())))
+                
+            elif file.name.endswith('.docx'):
+                documents.append((f"Word文件 '{file.name}'", [extract_docx_text(file.getvalue())]))
+                
+            elif file.name.endswith('.txt'):
+                text = file.getvalue().decode('utf-8')
+                documents.append((f"文本文件 '{file.name}'", [text]))
+    
+    if input_text:
+        documents.append(("用户输入文本", [input_text]))
+    return documents
+
+
+def knowledge_context_for(documents, audit_type, region, industry, k):
+    """
+    以审核类型、行业和文档内容为查询，从知识库中检索最相关的条目，生成提示词中的知识库部分
+    """
+    query = f"{audit_type} {industry} " + "".join("".join(pages) for _, pages in documents)
+    with kb_lock:
+        relevant_laws = [law for law, _ in kb_index["法律法规"].search(query, k=k)]
+
+        # 区域政策只在所选区域和全国范围的政策中检索
+        relevant_policies = [
+            policy for policy, _ in kb_index["区域政策"].search(
+                f"{region} {query}", k=k,
+                where=lambda policy: region in policy["region"] or policy["region"] == "全国"
+            )
+        ]
     
-if 'audit_history' not in st.session_state:
-    st.session_state.audit_history = []
+    knowledge_context = ""
+    if relevant_laws:
+        knowledge_context += "相关法律法规:\n"
+        for law in relevant_laws:
+            knowledge_context += f"- {law['title']}: {law['description']}\n"
+    
+    if relevant_policies:
+        knowledge_context += "\n相关区域政策:\n"
+        for policy in relevant_policies:
+            knowledge_context += f"- {policy['title']} ({policy['region']}): {policy['description']}\n"
+    return knowledge_context
+
+
+def run_audit(documents, audit_options, complete, chunk_tokens=None, concurrency=4, on_token=None, progress=None,
+              incremental_model=None, section_cache=None, stats=None):
+    """
+    chunk_tokens 为空时把所有文档放进一次请求，否则分块并发审核；
+    同时给出 incremental_model（complete 使用的模型）和 section_cache 时按章节增量审核，只重新审核修改过或新增的章节
+    """
+    if chunk_tokens and incremental_model and section_cache is not None:
+        return audit_sections(documents, audit_options, complete, section_cache, incremental_model,
+                              max_section_tokens=chunk_tokens, concurrency=concurrency, on_token=on_token,
+                              progress=progress, stats=stats)
+    if chunk_tokens:
+        return audit_map_reduce(documents, audit_options, complete, max_chunk_tokens=chunk_tokens,
+                                concurrency=concurrency, on_token=on_token, progress=progress)
+    document_text = "".join(f"{label}:\n{''.join(pages)}" for label, pages in documents)
+    report = complete(build_audit_prompt(document_text, audit_options), on_token=on_token)
+    if progress:
+        progress(1, 1)
+    return report
+
+
+def background_audit(uploaded_files, input_text, audit_options, retrieval_k, complete, progress=None, **audit_kwargs):
+    """
+    后台任务的审核函数：在工作线程中提取文件、检索知识库后调用 run_audit，
+    audit_options 中的 knowledge_context 由这里填入
+    """
+    documents = load_documents(uploaded_files, input_text)
+    knowledge_context = knowledge_context_for(documents, audit_options["audit_type"], audit_options["region"],
+                                              audit_options["industry"], retrieval_k)
+    return run_audit(documents, dict(audit_options, knowledge_context=knowledge_context), complete,
+                     progress=progress, **audit_kwargs)
+
+
+@st.cache_resource
+def get_request_limiter():
+    # 所有会话和后台任务共用的请求限制，可通过环境变量调整
+    return RequestLimiter(int(os.getenv("AUDIT_MAX_CONCURRENT_REQUESTS", "8")),
+                          float(os.getenv("AUDIT_REQUESTS_PER_MINUTE", "60")))
+
+
+request_limiter = get_request_limiter()
+
+# 每个会话一个后台审核队列，审核在后台线程中进行，不阻塞页面
+if 'job_queue' not in st.session_state:
+    st.session_state.job_queue = JobQueue()
+
+
+@st.fragment(run_every=2)
+def show_jobs():
+    """
+    每 2 秒只刷新这一部分，显示后台任务的状态和进度
+    """
+    job_queue = st.session_state.job_queue
+    if not job_queue.jobs:
+        return
+    
+    st.subheader("后台审核任务")
+    active = job_queue.active()
+    st.caption(f"共 {len(job_queue.jobs)} 个任务，{len(active)} 个未完成")
+    for job in reversed(job_queue.jobs):
+        collected_mark = "，已收集" if job.collected else ""
+        st.progress(job.progress, text=f"#{job.id} {job.name} - {job.status}{collected_mark}")
+        if job.error:
+            st.error(f"#{job.id} 审核失败: {job.error}")
+    
+    ready = job_queue.ready()
+    if st.button(f"收集已完成的报告到审核历史（{len(ready)} 份）", disabled=not ready):
+        for job in ready:
+            store.add_audit(job.record())
+            job.collected = True
+        st.success(f"已收集 {len(ready)} 份报告")
+
 
 # 侧边栏配置
 st.sidebar.header("⚙️ 系统设置")
@@ -44,6 +245,17 @@ model = st.sidebar.selectbox(
     ["deepseek-chat", "deepseek-coder"]
 )
 
+# 审核结果缓存：提示词和模型参数完全相同时直接返回之前的结果
+use_result_cache = st.sidebar.checkbox("使用审核结果缓存", value=True)
+cache_stats = result_cache.stats()
+st.sidebar.caption(
+    f"缓存 {cache_stats['entries']} 条（{cache_stats['bytes'] / 1024:.0f} KB），"
+    f"本次运行命中率 {cache_stats['hit_rate']:.0%}（{cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}）"
+)
+if st.sidebar.button("清空审核结果缓存"):
+    result_cache.clear()
+    findings_cache.clear()
+
 # 创建选项卡
 tab1, tab2, tab3 = st.tabs(["📊 合规审核", "📚 知识库管理", "📜 审核历史"])
 
@@ -71,7 +283,7 @@ with tab1:
     
     # 文件上传区域
     st.subheader("上传审核文件")
-    uploaded_files = st.file_uploader("上传PDF、Excel或文本文件", type=["pdf", "xlsx", "txt", "docx"], accept_multiple_files=True)
+    uploaded_files = st.file_uploader("上传PDF、Excel、Word或文本文件", type=["pdf", "xlsx", "txt", "docx"], accept_multiple_files=True)
     
     # 文本输入区域
     st.subheader("或直接输入文本")
@@ -83,6 +295,15 @@ with tab1:
         include_recommendations = st.checkbox("包含改进建议", value=True)
         include_legal_references = st.checkbox("包含法律条款引用", value=True)
         risk_scoring = st.checkbox("风险评分", value=True)
+        # 大文档按 token 预算分块并发审核，再合并各块结果
+        chunked_audit = st.checkbox("大文档分块并行审核", value=True)
+        chunk_tokens = st.number_input("每块最大 token 数", min_value=1000, max_value=60000, value=6000, step=1000,
+                                       disabled=not chunked_audit)
+        concurrency = st.number_input("并发请求数", min_value=1, max_value=16, value=4, disabled=not chunked_audit)
+        # 修订版文档只重新审核修改过或新增的章节，未变章节复用之前的审核结果
+        incremental_audit = st.checkbox("增量审核（只审核修改过的章节）", value=True, disabled=not chunked_audit)
+        stream_output = st.checkbox("流式输出报告", value=True)
+        retrieval_k = st.slider("每类检索的知识条目数", 1, 50, 10)
     
     # 审核按钮
     if st.button("开始合规审核"):
@@ -93,131 +314,117 @@ with tab1:
         else:
             with st.spinner("正在进行合规审核，请稍候..."):
                 try:
-                    # 处理上传的文件
-                    document_texts = []
-                    
-                    if uploaded_files:
-                        for file in uploaded_files:
-                            if file.name.endswith('.pdf'):
-                                pdf_reader = PyPDF2.PdfReader(file)
-                                text = ""
-                                for page in pdf_reader.pages:
-                                    text += page.extract_text()
-                                document_texts.append(f"PDF文件 '{file.name}':\n{text}")
-                                
-                            elif file.name.endswith('.xlsx'):
-                                df = pd.read_excel(file)
-                                text = df.to_string()
-                                document_texts.append(f"Excel文件 '{file.name}':\n{text}")
-                                
-                            elif file.name.endswith('.txt'):
-                                text = file.read().decode('utf-8')
-                                document_texts.append(f"文本文件 '{file.name}':\n{text}")
-                    
-                    if input_text:
-                        document_texts.append(f"用户输入文本:\n{input_text}")
+                    documents = load_documents(uploaded_files, input_text)
+                    knowledge_context = knowledge_context_for(documents, audit_type, region, industry, retrieval_k)
                     
-                    # 获取相关知识库内容
-                    relevant_laws = []
-                    for law in st.session_state.knowledge_base["法律法规"]:
-                        if audit_type.lower() in law["description"].lower() or audit_type.lower() in law["title"].lower():
-                            relevant_laws.append(law)
-                    
-                    relevant_policies = []
-                    for policy in st.session_state.knowledge_base["区域政策"]:
-                        if region in policy["region"]:
-                            relevant_policies.append(policy)
-                    
-                    # 构建提示词
-                    knowledge_context = ""
-                    if relevant_laws:
-                        knowledge_context += "相关法律法规:\n"
-                        for law in relevant_laws:
-                            knowledge_context += f"- {law['title']}: {law['description']}\n"
-                    
-                    if relevant_policies:
-                        knowledge_context += "\n相关区域政策:\n"
-                        for policy in relevant_policies:
-                            knowledge_context += f"- {policy['title']} ({policy['region']}): {policy['description']}\n"
-                    
-                    prompt = f"""
-                    你是一位专业的AI合规审核专家，请对以下文档进行{audit_type}审核。
-
-                    审核区域: {region}
-                    行业: {industry}
-                    审核深度: {thoroughness}/5
-                    
-                    {knowledge_context if knowledge_context else ""}
-                    
-                    需要审核的文档内容:
-                    {"".join(document_texts)}
-                    
-                    请执行以下任务:
-                    1. 识别所有潜在的合规风险点
-                    2. 对每个风险点进行详细分析
-                    3. 引用相关法律法规条款
-                    4. 评估风险等级（高/中/低）
-                    {"5. 提供具体的改进建议" if include_recommendations else ""}
-                    {"6. 为每个风险点提供详细的法律依据" if include_legal_references else ""}
-                    {"7. 为整体合规状况提供1-100的风险评分" if risk_scoring else ""}
+                    audit_options = {
+                        "audit_type": audit_type,
+                        "region": region,
+                        "industry": industry,
+                        "thoroughness": thoroughness,
+                        "knowledge_context": knowledge_context,
+                        "include_recommendations": include_recommendations,
+                        "include_legal_references": include_legal_references,
+                        "risk_scoring": risk_scoring
+                    }
                     
-                    请以结构化的方式输出审核报告，包括摘要、详细分析和结论部分。
-                    """
+                    # 显示审核报告，流式输出时报告随生成逐步显示
+                    st.subheader("📋 合规审核报告")
+                    st.markdown("---")
+                    report_placeholder = st.empty()
+                    on_token = stream_to(report_placeholder) if stream_output else None
                     
                     # 调用DeepSeek API
-                    headers = {
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {api_key}"
-                    }
+                    request_timings = []
+                    section_stats = {}
+                    complete = functools.partial(chat_completion, api_key, model, timings=request_timings,
+                                                 cache=result_cache if use_result_cache else None,
+                                                 limiter=request_limiter)
+                    audit_report = run_audit(documents, audit_options, complete,
+                                             chunk_tokens=chunk_tokens if chunked_audit else None,
+                                             concurrency=concurrency, on_token=on_token,
+                                             incremental_model=model if incremental_audit else None,
+                                             section_cache=findings_cache if use_result_cache else None,
+                                             stats=section_stats)
+                    report_placeholder.markdown(audit_report)
                     
-                    payload = {
-                        "model": model,
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "temperature": 0.3,
-                        "max_tokens": 4000
-                    }
+                    # 保存到审核历史
+                    store.add_audit({
+                        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "audit_type": audit_type,
+                        "region": region,
+                        "industry": industry,
+                        "report": audit_report,
+                        "cached": all(t["cached"] for t in request_timings)
+                    })
                     
-                    response = requests.post(
-                        "https://api.deepseek.com/v1/chat/completions",
-                        headers=headers,
-                        data=json.dumps(payload)
+                    final_timing = request_timings[-1]
+                    cached_count = sum(t["cached"] for t in request_timings)
+                    st.caption(
+                        f"请求 {len(request_timings)} 次（缓存命中 {cached_count} 次），"
+                        f"重试 {sum(t['retries'] for t in request_timings)} 次 | "
+                        f"最终报告首字延迟 {final_timing['ttft'] or 0:.2f} 秒，耗时 {final_timing['total']:.2f} 秒"
                     )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        audit_report = result["choices"][0]["message"]["content"]
-                        
-                        # 保存到审核历史
-                        st.session_state.audit_history.append({
-                            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "audit_type": audit_type,
-                            "region": region,
-                            "industry": industry,
-                            "report": audit_report
-                        })
-                        
-                        # 显示审核报告
-                        st.subheader("📋 合规审核报告")
-                        st.markdown("---")
-                        st.markdown(audit_report)
-                        
-                        # 提供下载按钮
-                        report_download = audit_report.encode()
-                        st.download_button(
-                            label="下载审核报告",
-                            data=report_download,
-                            file_name=f"合规审核报告_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md",
-                            mime="text/markdown"
+                    if section_stats:
+                        st.caption(
+                            f"增量审核：共 {section_stats['sections']} 个章节，复用 {section_stats['reused']} 个，"
+                            f"重新审核 {section_stats['audited']} 个"
                         )
-                        
-                    else:
-                        st.error(f"API请求失败: {response.status_code}")
-                        st.json(response.json())
+                    
+                    # 提供下载按钮
+                    report_download = audit_report.encode()
+                    st.download_button(
+                        label="下载审核报告",
+                        data=report_download,
+                        file_name=f"合规审核报告_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md",
+                        mime="text/markdown"
+                    )
+                
+                except APIError as e:
+                    st.error(str(e))
+                    try:
+                        st.json(json.loads(e.body))
+                    except ValueError:
+                        st.code(e.body)
                 
                 except Exception as e:
                     st.error(f"发生错误: {str(e)}")
+    
+    # 后台审核：每个文件一个任务，提交后立即返回，可以继续使用其他选项卡
+    if st.button("按文件加入后台审核队列"):
+        if not api_key:
+            st.error("请输入DeepSeek API密钥")
+        elif not uploaded_files and not input_text:
+            st.error("请上传文件或输入文本")
+        else:
+            # 文件提取和知识库检索都在任务中进行，上传文件的内容已在内存中，可以交给工作线程读取
+            sources = [(file.name, [file], None) for file in uploaded_files or []]
+            if input_text:
+                sources.append(("用户输入文本", [], input_text))
+            
+            complete = functools.partial(chat_completion, api_key, model,
+                                         cache=result_cache if use_result_cache else None, limiter=request_limiter)
+            audit_options = {
+                "audit_type": audit_type,
+                "region": region,
+                "industry": industry,
+                "thoroughness": thoroughness,
+                "include_recommendations": include_recommendations,
+                "include_legal_references": include_legal_references,
+                "risk_scoring": risk_scoring
+            }
+            for name, files, text in sources:
+                st.session_state.job_queue.submit(
+                    name,
+                    functools.partial(background_audit, files, text, audit_options, retrieval_k, complete,
+                                      chunk_tokens=chunk_tokens if chunked_audit else None, concurrency=concurrency,
+                                      incremental_model=model if incremental_audit else None,
+                                      section_cache=findings_cache if use_result_cache else None),
+                    meta={"audit_type": audit_type, "region": region, "industry": industry}
+                )
+            st.success(f"已加入 {len(sources)} 个后台审核任务")
+    
+    show_jobs()
 
 # 知识库管理选项卡
 with tab2:
@@ -238,7 +445,7 @@ with tab2:
         
         if st.button("添加法律法规"):
             if law_title and law_description:
-                st.session_state.knowledge_base["法律法规"].append({
+                add_knowledge("法律法规", {
                     "title": law_title,
                     "description": law_description,
                     "category": law_category,
@@ -250,15 +457,20 @@ with tab2:
         
         # 显示现有法律法规
         st.subheader("现有法律法规")
-        if st.session_state.knowledge_base["法律法规"]:
-            for i, law in enumerate(st.session_state.knowledge_base["法律法规"]):
+        law_query = st.text_input("搜索法律法规", key="law_query")
+        law_total = store.count_knowledge("法律法规", law_query)
+        if law_total:
+            law_offset = page_selector(law_total, "law_page")
+            for law in store.list_knowledge("法律法规", law_query, PAGE_SIZE, law_offset):
                 with st.expander(f"{law['title']} ({law['category']})"):
                     st.write(f"**类别:** {law['category']}")
                     st.write(f"**添加日期:** {law['added_date']}")
                     st.write(f"**内容摘要:** {law['description']}")
-                    if st.button("删除", key=f"del_law_{i}"):
-                        st.session_state.knowledge_base["法律法规"].pop(i)
-                        st.experimental_rerun()
+                    if st.button("删除", key=f"del_law_{law['id']}"):
+                        remove_knowledge(law)
+                        st.rerun()
+        elif law_query:
+            st.info("没有匹配的法律法规")
         else:
             st.info("暂无法律法规，请添加")
     
@@ -274,7 +486,7 @@ with tab2:
         
         if st.button("添加区域政策"):
             if policy_title and policy_description:
-                st.session_state.knowledge_base["区域政策"].append({
+                add_knowledge("区域政策", {
                     "title": policy_title,
                     "region": policy_region,
                     "description": policy_description,
@@ -286,15 +498,20 @@ with tab2:
         
         # 显示现有区域政策
         st.subheader("现有区域政策")
-        if st.session_state.knowledge_base["区域政策"]:
-            for i, policy in enumerate(st.session_state.knowledge_base["区域政策"]):
+        policy_query = st.text_input("搜索区域政策", key="policy_query")
+        policy_total = store.count_knowledge("区域政策", policy_query)
+        if policy_total:
+            policy_offset = page_selector(policy_total, "policy_page")
+            for policy in store.list_knowledge("区域政策", policy_query, PAGE_SIZE, policy_offset):
                 with st.expander(f"{policy['title']} ({policy['region']})"):
                     st.write(f"**适用区域:** {policy['region']}")
                     st.write(f"**添加日期:** {policy['added_date']}")
                     st.write(f"**内容摘要:** {policy['description']}")
-                    if st.button("删除", key=f"del_policy_{i}"):
-                        st.session_state.knowledge_base["区域政策"].pop(i)
-                        st.experimental_rerun()
+                    if st.button("删除", key=f"del_policy_{policy['id']}"):
+                        remove_knowledge(policy)
+                        st.rerun()
+        elif policy_query:
+            st.info("没有匹配的区域政策")
         else:
             st.info("暂无区域政策，请添加")
     
@@ -344,8 +561,8 @@ with tab2:
                     ]
                     
                     for law in new_laws:
-                        if law not in st.session_state.knowledge_base["法律法规"]:
-                            st.session_state.knowledge_base["法律法规"].append(law)
+                        if not store.has_knowledge("法律法规", law["title"]):
+                            add_knowledge("法律法规", law)
                     
                     # 模拟添加新的区域政策
                     new_policies = [
@@ -358,8 +575,8 @@ with tab2:
                     ]
                     
                     for policy in new_policies:
-                        if policy not in st.session_state.knowledge_base["区域政策"]:
-                            st.session_state.knowledge_base["区域政策"].append(policy)
+                        if not store.has_knowledge("区域政策", policy["title"]):
+                            add_knowledge("区域政策", policy)
                     
                     st.success(f"知识库更新完成！新增法规 {len(new_laws)} 条，新增政策 {len(new_policies)} 条")
             else:
@@ -369,19 +586,29 @@ with tab2:
 with tab3:
     st.header("审核历史记录")
     
-    if st.session_state.audit_history:
-        for i, audit in enumerate(reversed(st.session_state.audit_history)):
-            with st.expander(f"{audit['timestamp']} - {audit['audit_type']} ({audit['region']}, {audit['industry']})"):
-                st.markdown(audit['report'])
-                
-                # 提供下载按钮
-                report_download = audit['report'].encode()
-                st.download_button(
-                    label="下载此报告",
-                    data=report_download,
-                    file_name=f"合规审核报告_{audit['timestamp'].replace(' ', '_').replace(':', '')}.md",
-                    mime="text/markdown"
-                )
+    # 每页只查询列表字段，报告正文在勾选“显示报告”后才从数据库读取
+    history_query = st.text_input("搜索报告内容", key="history_query")
+    history_total = store.count_audits(history_query)
+    if history_total:
+        history_offset = page_selector(history_total, "history_page")
+        for audit in store.list_audits(history_query, PAGE_SIZE, history_offset):
+            cached_mark = "（缓存）" if audit["cached"] else ""
+            with st.expander(f"{audit['timestamp']} - {audit['audit_type']} ({audit['region']}, {audit['industry']}){cached_mark}"):
+                if st.checkbox("显示报告", key=f"show_report_{audit['id']}"):
+                    report = store.get_report(audit["id"])
+                    st.markdown(report)
+                    
+                    # 提供下载按钮
+                    report_download = report.encode()
+                    st.download_button(
+                        label="下载此报告",
+                        data=report_download,
+                        file_name=f"合规审核报告_{audit['timestamp'].replace(' ', '_').replace(':', '')}.md",
+                        mime="text/markdown",
+                        key=f"download_report_{audit['id']}"
+                    )
+    elif history_query:
+        st.info("没有匹配的审核记录")
     else:
         st.info("暂无审核历史记录")
 
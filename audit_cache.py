@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """
+    以请求参数的哈希为键，把模型返回的结果保存在 SQLite 中，进程重启后仍然有效。
+    超过 ttl 秒的结果视为过期，总大小超过 max_bytes 时按最近访问时间淘汰
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 分块审核会在多个线程中读写缓存，连接由锁保护
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+def make_key(**params):
+    """
+    由最终提示词和模型参数生成缓存键，参数顺序不影响结果
+    """
+    data = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+# 模块级缓存在 Streamlit 的多次重新运行之间保持不变，位置、有效期和大小可通过环境变量调整
+result_cache = ResultCache(
+    os.getenv("AUDIT_CACHE_PATH", "audit_cache.sqlite3"),
+    ttl=float(os.getenv("AUDIT_CACHE_TTL_HOURS", "168")) * 3600,
+    max_bytes=int(os.getenv("AUDIT_CACHE_MB", "100")) * 1024 * 1024,
+)
+
+# 增量审核时每个章节的审核结果，文档修订后未修改的章节直接复用，默认保留 30 天
+findings_cache = ResultCache(
+    os.getenv("AUDIT_FINDINGS_PATH", "audit_findings.sqlite3"),
+    ttl=float(os.getenv("AUDIT_FINDINGS_TTL_HOURS", "720")) * 3600,
+    max_bytes=int(os.getenv("AUDIT_FINDINGS_MB", "200")) * 1024 * 1024,
+)
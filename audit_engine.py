@@ -0,0 +1,465 @@
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+import requests.adapters
+
+from audit_cache import make_key
+
+# 可以通过环境变量指向本地的兼容接口，方便在没有真实 API 的情况下测试
+API_BASE = os.getenv("DEEPSEEK_API_BASE", "https://api.deepseek.com/v1")
+
+_CJK = re.compile(r"[　-〿㐀-鿿豈-﫿＀-￯]")
+# 条款、章节等标题行，作为切分文档的边界
+_SECTION_HEADING = re.compile(
+    r"^\s*(第[一二三四五六七八九十百千零\d]+[编章节条款]|[一二三四五六七八九十]+、|\d+(\.\d+)*[.、]\s*\S|#+\s)",
+    re.MULTILINE,
+)
+
+
+# 连接超时和读取超时（秒），读取超时是两次收到数据之间的最长等待时间
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+# 429 和 5xx 按指数退避重试：BACKOFF、2*BACKOFF、4*BACKOFF……
+MAX_RETRIES = 4
+BACKOFF = 1.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"API请求失败: {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+class RequestLimiter:
+    """
+    全局请求限制：同时进行的请求不超过 max_concurrent 个，每分钟发起的请求不超过 per_minute 个。
+    作为上下文管理器使用，所有会话和后台任务共用同一个实例
+    """
+
+    def __init__(self, max_concurrent, per_minute):
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        # per_minute 为 0 时不限制频率，只限制并发数
+        self._interval = 60 / per_minute if per_minute > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+
+def _make_session():
+    # 复用 keep-alive 连接，连接池大小要覆盖分块审核的并发数
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = _make_session()
+
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return BACKOFF * 2 ** attempt
+
+
+def _post(url, headers, payload, stream):
+    """
+    发送请求，连接失败、超时或返回 429/5xx 时按指数退避重试，返回 (响应, 重试次数)
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        try:
+            response = session.post(url, headers=headers, data=json.dumps(payload), stream=stream,
+                                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                return response, attempt
+            response.close()
+        time.sleep(_retry_delay(response, attempt))
+
+
+def _iter_stream(response):
+    """
+    解析 SSE 响应，逐个返回增量文本。[DONE] 之后仍读完响应体，连接才能放回连接池复用
+    """
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            continue
+        delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+
+def chat_completion(api_key, model, prompt, max_tokens=4000, temperature=0.3, on_token=None, timings=None,
+                    cache=None, limiter=None):
+    """
+    调用对话接口并返回完整回复。传入 on_token 时使用流式输出，每收到一段文本就调用 on_token(文本)；
+    传入 timings 列表时追加本次请求的首字延迟 ttft、总耗时 total（秒）、重试次数 retries 和是否命中缓存 cached；
+    传入 cache（audit_cache.ResultCache）时，提示词和模型参数完全相同的请求直接返回缓存的结果；
+    传入 limiter（RequestLimiter）时，实际发出的请求受其并发数和频率限制，命中缓存不占用额度
+    """
+    key = make_key(model=model, prompt=prompt, max_tokens=max_tokens, temperature=temperature)
+    content = cache.get(key) if cache is not None else None
+    if content is not None:
+        if on_token is not None:
+            on_token(content)
+        if timings is not None:
+            timings.append({"ttft": 0.0, "total": 0.0, "retries": 0, "stream": on_token is not None,
+                            "cached": True})
+        return content
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": on_token is not None
+    }
+
+    with limiter or contextlib.nullcontext():
+        start = time.perf_counter()
+        content, ttft, retries = _request(headers, payload, on_token)
+
+    if cache is not None:
+        cache.put(key, content)
+    if timings is not None:
+        timings.append({"ttft": ttft, "total": time.perf_counter() - start, "retries": retries,
+                        "stream": on_token is not None, "cached": False})
+    return content
+
+
+def _request(headers, payload, on_token):
+    """
+    发出请求并读取回复，返回 (回复, 首字延迟, 重试次数)
+    """
+    start = time.perf_counter()
+    response, retries = _post(f"{API_BASE}/chat/completions", headers, payload, stream=on_token is not None)
+    with response:
+        if response.status_code != 200:
+            raise APIError(response.status_code, response.text)
+        if on_token is None:
+            content = response.json()["choices"][0]["message"]["content"]
+            ttft = time.perf_counter() - start
+        else:
+            parts, ttft = [], None
+            for delta in _iter_stream(response):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                parts.append(delta)
+                on_token(delta)
+            content = "".join(parts)
+    return content, ttft, retries
+
+
+def estimate_tokens(text):
+    """
+    粗略估计 token 数：中文等宽字符按每字 1 个 token，其余按每 4 个字符 1 个 token，宁多勿少
+    """
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def build_audit_prompt(document_text, options, part=None):
+    """
+    构建审核提示词。options 包含 audit_type、region、industry、thoroughness、knowledge_context、
+    include_recommendations、include_legal_references、risk_scoring；
+    part 为 (序号, 总数) 时表示只审核文档的一部分，为 "section" 时表示只审核一个章节，由后续的合并步骤给出整体结论。
+    章节提示词不包含文件名和位置，文档修订后内容未变的章节生成的提示词保持不变
+    """
+    if part == "section":
+        scope = "以下内容是文档中的一个章节，请只审核这一章节，逐条列出发现的风险点，不需要给出整体结论。"
+        output = "请逐条输出风险点，每条注明所在条款、风险等级和分析。"
+    elif part:
+        scope = f"以下内容是文档的第 {part[0]}/{part[1]} 部分，请只审核这一部分，逐条列出发现的风险点，不需要给出整体结论。"
+        output = "请逐条输出风险点，每条注明所在文件和页码、风险等级和分析。"
+    else:
+        scope = ""
+        output = "请以结构化的方式输出审核报告，包括摘要、详细分析和结论部分。"
+
+    return f"""
+    你是一位专业的AI合规审核专家，请对以下文档进行{options['audit_type']}审核。{scope}
+
+    审核区域: {options['region']}
+    行业: {options['industry']}
+    审核深度: {options['thoroughness']}/5
+
+    {options['knowledge_context']}
+
+    需要审核的文档内容:
+    {document_text}
+
+    请执行以下任务:
+    1. 识别所有潜在的合规风险点
+    2. 对每个风险点进行详细分析
+    3. 引用相关法律法规条款
+    4. 评估风险等级（高/中/低）
+    {"5. 提供具体的改进建议" if options['include_recommendations'] else ""}
+    {"6. 为每个风险点提供详细的法律依据" if options['include_legal_references'] else ""}
+    {"7. 为整体合规状况提供1-100的风险评分" if options['risk_scoring'] and not part else ""}
+
+    {output}
+    """
+
+
+def build_merge_prompt(findings, options, final=True):
+    """
+    构建合并各部分审核结果的提示词，final 为假时只做中间合并，不生成最终报告
+    """
+    joined = "\n\n".join(f"【第 {i+1} 部分的审核结果】\n{text}" for i, text in enumerate(findings))
+    if final:
+        output = f"""请将以上结果合并为一份完整的{options['audit_type']}审核报告：去除重复的风险点，统一风险等级，
+    {"保留改进建议，" if options['include_recommendations'] else ""}{"保留法律依据，" if options['include_legal_references'] else ""}{"为整体合规状况提供1-100的风险评分，" if options['risk_scoring'] else ""}
+    并以结构化的方式输出，包括摘要、详细分析和结论部分。"""
+    else:
+        output = "请将以上结果合并去重，逐条输出风险点，保留所在文件和页码、风险等级和分析，不需要给出整体结论。"
+
+    return f"""
+    你是一位专业的AI合规审核专家。以下是对同一批文档（审核区域: {options['region']}，行业: {options['industry']}）
+    分块进行{options['audit_type']}审核得到的结果。
+
+    {joined}
+
+    {output}
+    """
+
+
+def split_sections(text):
+    """
+    按条款/章节标题切分文本，标题行属于它后面的段落
+    """
+    starts = [m.start() for m in _SECTION_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)]) if text[a:b].strip()]
+
+
+def _split_oversized(text, max_tokens):
+    """
+    单个段落仍然超出预算时，先按行切分，仍然过长的行按字符硬切
+    """
+    pieces, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while estimate_tokens(line) > max_tokens:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_tokens])
+            line = line[max_tokens:]
+        if current and estimate_tokens(current + line) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_documents(documents, max_tokens):
+    """
+    将 [(文档名, [每页文本])] 按 token 预算切分成若干块。
+    优先沿页边界合并，单页超出预算时再沿条款/章节边界切分，每段都标注来源文件和页码
+    """
+    units = []
+    for label, pages in documents:
+        for page_number, page in enumerate(pages, start=1):
+            header = f"【{label} 第{page_number}页】\n" if len(pages) > 1 else f"【{label}】\n"
+            budget = max_tokens - estimate_tokens(header)
+            if estimate_tokens(page) <= budget:
+                units.append(header + page)
+                continue
+            for section in split_sections(page):
+                pieces = [section] if estimate_tokens(section) <= budget else _split_oversized(section, budget)
+                units.extend(header + piece for piece in pieces)
+
+    chunks, current = [], ""
+    for unit in units:
+        if current and estimate_tokens(current) + estimate_tokens(unit) > max_tokens:
+            chunks.append(current)
+            current = ""
+        current += unit + "\n"
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _group(texts, max_tokens):
+    """
+    将中间结果按预算分组，每组至少两条，保证每轮合并都能减少结果数量
+    """
+    groups, current, used = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if len(current) >= 2 and used + tokens > max_tokens:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += tokens
+    if len(current) == 1 and groups:
+        groups[-1].append(current[0])
+    elif current:
+        groups.append(current)
+    return groups
+
+
+def audit_map_reduce(documents, options, complete, max_chunk_tokens=6000, concurrency=4, on_token=None,
+                     progress=None):
+    """
+    分块并发审核：把文档切成不超过 max_chunk_tokens 的块，最多 concurrency 个请求同时进行，
+    再把各块的结果合并成一份报告（结果过多时逐层合并）。
+    complete(prompt, on_token=None) 负责调用模型并返回文本，例如 functools.partial(chat_completion, api_key, model)；
+    on_token 只用于在调用线程中生成最终报告的那次请求；
+    progress(已完成, 总数) 在每个分块审核完成时调用，可能在工作线程中调用
+    """
+    chunks = chunk_documents(documents, max_chunk_tokens)
+    if len(chunks) == 1:
+        report = complete(build_audit_prompt(chunks[0], options), on_token=on_token)
+        if progress:
+            progress(1, 1)
+        return report
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        prompts = [build_audit_prompt(chunk, options, part=(i + 1, len(chunks))) for i, chunk in enumerate(chunks)]
+        futures = [executor.submit(complete, prompt) for prompt in prompts]
+        # 合并步骤算作最后一步
+        for done, _ in enumerate(concurrent.futures.as_completed(futures), start=1):
+            if progress:
+                progress(done, len(chunks) + 1)
+        findings = [future.result() for future in futures]
+        report = _reduce(findings, options, complete, executor, max_chunk_tokens, on_token)
+
+    if progress:
+        progress(len(chunks) + 1, len(chunks) + 1)
+    return report
+
+
+def _reduce(findings, options, complete, executor, max_tokens, on_token):
+    """
+    结果超出预算时先分组做中间合并，最后合并成一份报告
+    """
+    while len(findings) > 2 and sum(estimate_tokens(f) for f in findings) > max_tokens:
+        groups = _group(findings, max_tokens)
+        findings = list(executor.map(complete, [build_merge_prompt(g, options, final=False) for g in groups]))
+    return complete(build_merge_prompt(findings, options), on_token=on_token)
+
+
+def section_hash(text):
+    """
+    章节内容的哈希，忽略空白字符的差异（例如 PDF 重新排版造成的换行变化）
+    """
+    return hashlib.sha256(re.sub(r"\s+", "", text).encode()).hexdigest()
+
+
+def stable_sections(documents, max_tokens, min_tokens=None):
+    """
+    将文档切成内容决定边界的章节，返回 [(文档名, 章节文本)]。
+    先沿条款/章节标题切分，再把相邻的小段合并：累计达到 min_tokens 后，
+    在哈希值满足条件的段落之后断开，或者在下一段放不下时断开。
+    边界只由附近的内容决定，修改一处条款只会影响它所在的章节，其余章节的文本和哈希保持不变
+    """
+    min_tokens = min_tokens or max_tokens // 4
+    sections = []
+    for label, pages in documents:
+        pieces = []
+        for section in split_sections("\n".join(pages)):
+            if estimate_tokens(section) > max_tokens:
+                pieces.extend(_split_oversized(section, max_tokens))
+            else:
+                pieces.append(section)
+
+        current, used = "", 0
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and used + tokens > max_tokens:
+                sections.append((label, current))
+                current, used = "", 0
+            current += piece
+            used += tokens
+            if used >= min_tokens and int(section_hash(piece)[:8], 16) % 4 == 0:
+                sections.append((label, current))
+                current, used = "", 0
+        if current.strip():
+            sections.append((label, current))
+    return sections
+
+
+def audit_sections(documents, options, complete, findings_cache, model, max_section_tokens=6000, concurrency=4,
+                   on_token=None, progress=None, stats=None):
+    """
+    增量审核：按 stable_sections 切分文档，以章节哈希、审核选项和模型为键在 findings_cache 中缓存每个章节的审核结果，
+    只把新增或修改过的章节发给模型，再与未变章节的缓存结果一起合并成报告。
+    knowledge_context 按整篇文档检索，知识库的任何变动都会改变它，因此不计入章节的缓存键。
+    文档一次请求就能放下时直接整体审核，只有一个章节时按普通分块审核，都不缓存章节结果。
+    stats 为字典时写入章节总数 sections、复用的章节数 reused 和重新审核的章节数 audited
+    """
+    chunks = chunk_documents(documents, max_section_tokens)
+    if len(chunks) == 1:
+        report = complete(build_audit_prompt(chunks[0], options), on_token=on_token)
+        if progress:
+            progress(1, 1)
+        return report
+    # 分块会加上每页的来源标注而章节不会，只有一个章节时分块仍可能超过一块，这时按普通分块审核
+    sections = stable_sections(documents, max_section_tokens)
+    if len(sections) == 1:
+        return audit_map_reduce(documents, options, complete, max_chunk_tokens=max_section_tokens,
+                                concurrency=concurrency, on_token=on_token, progress=progress)
+
+    section_options = {k: v for k, v in options.items() if k != "knowledge_context"}
+    keys = [make_key(kind="section-findings", model=model, section=section_hash(text), options=section_options)
+            for _, text in sections]
+    findings = [findings_cache.get(key) for key in keys]
+    missing = [i for i, finding in enumerate(findings) if finding is None]
+    total = len(missing) + 1
+    if stats is not None:
+        stats.update(sections=len(sections), reused=len(sections) - len(missing), audited=len(missing))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(complete, build_audit_prompt(sections[i][1], options, part="section")): i
+                   for i in missing}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            i = futures[future]
+            findings[i] = future.result()
+            findings_cache.put(keys[i], findings[i])
+            if progress:
+                progress(done, total)
+
+        # 合并时再标注章节所在的文件，文件改名不影响章节缓存
+        labelled = [f"【{label}】\n{finding}" for (label, _), finding in zip(sections, findings)]
+        report = _reduce(labelled, options, complete, executor, max_section_tokens, on_token)
+
+    if progress:
+        progress(total, total)
+    return report
@@ -0,0 +1,231 @@
+import collections
+import concurrent.futures
+import csv
+import datetime
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import xml.etree.ElementTree as ET
+import zipfile
+
+import openpyxl
+import PyPDF2
+
+# 按 (文件哈希, 页码) 缓存每页提取出的文本，同一文件换审核类型或区域重新审核时不再重复提取
+MAX_CACHED_PAGES = 50000
+_page_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+# 页数少于该值时串行提取，避免进程池的启动开销
+MIN_PARALLEL_PAGES = 32
+
+_worker_reader = None
+
+
+def _init_worker(data):
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(io.BytesIO(data))
+
+
+def _extract_pages(pages, reader=None):
+    reader = reader if reader is not None else _worker_reader
+    return [reader.pages[i].extract_text() or "" for i in pages]
+
+
+def _chunks(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def extract_pdf_pages(data, workers=None):
+    """
+    提取 PDF 每一页的文本，返回按页排列的列表。
+    未缓存的页面按连续区间分给进程池并行提取，每个工作进程只解析一次 PDF
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+
+    with _cache_lock:
+        cached = {i: _page_cache[(digest, i)] for i in range(page_count) if (digest, i) in _page_cache}
+        for i in cached:
+            _page_cache.move_to_end((digest, i))
+    missing = [i for i in range(page_count) if i not in cached]
+
+    if missing:
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(missing) < MIN_PARALLEL_PAGES:
+            texts = _extract_pages(missing, reader)
+        else:
+            # Streamlit 服务器是多线程的，用 spawn 启动工作进程，避免 fork 时复制其他线程持有的锁
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                        mp_context=multiprocessing.get_context("spawn"),
+                                                        initializer=_init_worker, initargs=(data,)) as executor:
+                # 每个进程分到几段连续页面，兼顾负载均衡和任务调度开销
+                results = executor.map(_extract_pages, _chunks(missing, workers * 4))
+                texts = [text for chunk in results for text in chunk]
+
+        with _cache_lock:
+            for i, text in zip(missing, texts):
+                cached[i] = text
+                _page_cache[(digest, i)] = text
+            while len(_page_cache) > MAX_CACHED_PAGES:
+                _page_cache.popitem(last=False)
+
+    return [cached[i] for i in range(page_count)]
+
+
+def extract_pdf_text(data, workers=None):
+    return "".join(extract_pdf_pages(data, workers))
+
+
+# 每个工作表最多保留的行数，超出部分不再读取，保证超大表格的内存占用和提示词长度都有上限
+MAX_SHEET_ROWS = 2000
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d") if value.time() == datetime.time() else value.isoformat(sep=" ")
+    return str(value).strip()
+
+
+def extract_xlsx_pages(data, max_rows=MAX_SHEET_ROWS):
+    """
+    以只读模式逐行读取所有工作表，每个工作表输出为一页紧凑的 CSV。
+    跳过空行，去掉所有保留行中都为空的列，每个工作表最多读取 max_rows 行
+    """
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        pages = []
+        for sheet in workbook.worksheets:
+            rows, truncated = [], False
+            for values in sheet.iter_rows(values_only=True):
+                row = [_cell_text(value) for value in values]
+                if not any(row):
+                    continue
+                if len(rows) == max_rows:
+                    truncated = True
+                    break
+                rows.append(row)
+            if not rows:
+                continue
+
+            width = max(len(row) for row in rows)
+            columns = [i for i in range(width) if any(i < len(row) and row[i] for row in rows)]
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            for row in rows:
+                writer.writerow([row[i] if i < len(row) else "" for i in columns])
+
+            note = ""
+            if truncated:
+                # 只读模式下 max_row 来自工作表记录的尺寸，可能缺失
+                total = f"，共约 {sheet.max_row} 行" if sheet.max_row else ""
+                note = f"（仅保留前 {max_rows} 行{total}）"
+            pages.append(f"工作表 '{sheet.title}'{note}:\n{buffer.getvalue()}")
+        return pages
+    finally:
+        workbook.close()
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def _paragraph_text(paragraph):
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == _W + "t":
+            parts.append(node.text or "")
+        elif node.tag == _W + "tab":
+            parts.append("\t")
+        elif node.tag in (_W + "br", _W + "cr"):
+            parts.append("\n")
+    return "".join(parts).strip()
+
+
+def _content(node):
+    """
+    依次给出节点的直接子节点，内容控件 w:sdt 展开为其 w:sdtContent 中的内容
+    """
+    for child in node:
+        if child.tag == _W + "sdt":
+            content = child.find(_W + "sdtContent")
+            if content is not None:
+                yield from _content(content)
+        else:
+            yield child
+
+
+def _table_text(table, nested=None):
+    """
+    表格输出为 Markdown 表格，单元格内的换行替换为空格。
+    单元格中嵌套的表格记为「[表格 N]」，其内容依次输出在最外层表格之后
+    """
+    outer = nested is None
+    if outer:
+        nested = []
+    lines = []
+    for row in _content(table):
+        if row.tag != _W + "tr":
+            continue
+        cells = []
+        for cell in _content(row):
+            if cell.tag != _W + "tc":
+                continue
+            parts = []
+            for child in _content(cell):
+                if child.tag == _W + "p":
+                    parts.append(_paragraph_text(child))
+                elif child.tag == _W + "tbl":
+                    # 先占位再递归，编号按表格在文档中出现的顺序
+                    nested.append("")
+                    number = len(nested)
+                    nested[number - 1] = _table_text(child, nested)
+                    parts.append(f"[表格 {number}]")
+            text = " ".join(filter(None, parts))
+            cells.append(text.replace("\n", " ").replace("|", "\\|"))
+        if any(cells):
+            lines.append("| " + " | ".join(cells) + " |")
+            if len(lines) == 1:
+                lines.append("|" + " --- |" * len(cells))
+    text = "\n".join(lines)
+    if outer:
+        text += "".join(f"\n\n表格 {number}：\n{table_text}" for number, table_text in enumerate(nested, start=1))
+    return text
+
+
+def extract_docx_text(data):
+    """
+    按文档顺序提取 DOCX 正文中的段落和表格，包括内容控件（w:sdt）中的段落和表格。
+    用 iterparse 流式解析 word/document.xml，每处理完一个正文层级的段落或表格就释放它
+    """
+    blocks = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive, archive.open("word/document.xml") as document:
+        # 栈中记录每个打开的节点的子节点是否处于正文层级：body 的子节点是，
+        # 正文层级的内容控件及其 sdtContent 的子节点也是；表格中的段落随表格一起处理
+        block_level = [False]
+        for event, node in ET.iterparse(document, events=("start", "end")):
+            if event == "start":
+                block_level.append(node.tag == _W + "body"
+                                   or (block_level[-1] and node.tag in (_W + "sdt", _W + "sdtContent")))
+                continue
+            block_level.pop()
+            if not block_level[-1]:
+                continue
+            if node.tag == _W + "p":
+                text = _paragraph_text(node)
+                if text:
+                    blocks.append(text)
+                node.clear()
+            elif node.tag == _W + "tbl":
+                text = _table_text(node)
+                if text:
+                    blocks.append(text)
+                node.clear()
+    return "\n".join(blocks)
@@ -0,0 +1,90 @@
+import concurrent.futures
+import datetime
+import threading
+
+# 任务状态
+PENDING = "排队中"
+RUNNING = "进行中"
+DONE = "已完成"
+FAILED = "失败"
+
+
+class AuditJob:
+    """
+    一个后台审核任务，状态和进度由工作线程更新，界面只读取
+    """
+
+    def __init__(self, job_id, name, meta):
+        self.id = job_id
+        self.name = name
+        self.meta = meta
+        self.status = PENDING
+        self.done = 0
+        self.total = 0
+        self.report = None
+        self.error = None
+        self.collected = False
+        self.submitted_at = datetime.datetime.now()
+        self.finished_at = None
+
+    @property
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def update(self, done, total):
+        self.done = done
+        self.total = total
+
+    def record(self):
+        """
+        审核历史中保存的记录
+        """
+        return dict(self.meta, timestamp=self.finished_at.strftime("%Y-%m-%d %H:%M:%S"), report=self.report)
+
+
+class JobQueue:
+    """
+    在线程池中运行审核任务，最多同时运行 workers 个任务。
+    任务内部的请求数和频率由传给任务的 RequestLimiter 统一限制
+    """
+
+    def __init__(self, workers=4):
+        self.jobs = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, meta=None):
+        """
+        提交任务，func(progress=...) 返回审核报告，执行中可以调用 progress(已完成, 总数) 报告进度
+        """
+        with self._lock:
+            job = AuditJob(len(self.jobs) + 1, name, meta or {})
+            self.jobs.append(job)
+        self._executor.submit(self._run, job, func)
+        return job
+
+    @staticmethod
+    def _run(job, func):
+        job.status = RUNNING
+        # 先写入结果再更新状态，界面看到已完成时结果一定可用
+        try:
+            report = func(progress=job.update)
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = datetime.datetime.now()
+            job.status = FAILED
+        else:
+            job.report = report
+            job.finished_at = datetime.datetime.now()
+            job.status = DONE
+
+    def active(self):
+        return [job for job in self.jobs if job.status in (PENDING, RUNNING)]
+
+    def ready(self):
+        """
+        已完成但还没有收集到审核历史中的任务
+        """
+        return [job for job in self.jobs if job.status == DONE and not job.collected]
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+
+from kb_index import tokenize
+
+# FTS5 默认的 unicode61 分词器把整段中文当作一个词，这里存入预先切好的两字词，
+# 查询时同样切分后要求所有词都出现
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS knowledge (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT,
+    region TEXT,
+    added_date TEXT
+);
+CREATE INDEX IF NOT EXISTS knowledge_kind ON knowledge (kind, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(body);
+
+CREATE TABLE IF NOT EXISTS audits (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    audit_type TEXT NOT NULL,
+    region TEXT NOT NULL,
+    industry TEXT NOT NULL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    report TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS audits_fts USING fts5(body);
+"""
+
+_KNOWLEDGE_FIELDS = ("id", "kind", "title", "description", "category", "region", "added_date")
+_AUDIT_FIELDS = ("id", "timestamp", "audit_type", "region", "industry", "cached")
+
+
+def _fts_text(*parts):
+    return " ".join(tokenize(" ".join(part or "" for part in parts)))
+
+
+def _fts_query(text):
+    tokens = tokenize(text)
+    return " ".join(f'"{token}"' for token in tokens) if tokens else None
+
+
+class AuditStore:
+    """
+    知识库和审核历史的 SQLite 存储，报告正文只在需要时单独读取
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _filter(table, where, params, query):
+        """
+        query 非空时加上全文索引的过滤条件
+        """
+        match = _fts_query(query) if query else None
+        if match:
+            where += f" AND id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?)"
+            params = params + (match,)
+        return where, params
+
+    def _count(self, table, where, params, query):
+        where, params = self._filter(table, where, params, query)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+
+    def _page(self, table, fields, where, params, query, limit, offset):
+        """
+        按编号倒序（即添加时间倒序）分页查询
+        """
+        where, params = self._filter(table, where, params, query)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(fields)} FROM {table} WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                params + (limit, offset),
+            ).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def add_knowledge(self, kind, entry):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO knowledge (kind, title, description, category, region, added_date) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, entry["title"], entry["description"], entry.get("category"), entry.get("region"),
+                 entry.get("added_date")),
+            )
+            self._conn.execute("INSERT INTO knowledge_fts (rowid, body) VALUES (?, ?)",
+                               (cursor.lastrowid, _fts_text(entry["title"], entry["description"])))
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def delete_knowledge(self, entry_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM knowledge WHERE id = ?", (entry_id,))
+            self._conn.execute("DELETE FROM knowledge_fts WHERE rowid = ?", (entry_id,))
+            self._conn.commit()
+
+    def has_knowledge(self, kind, title):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM knowledge WHERE kind = ? AND title = ?", (kind, title)).fetchone()
+        return row is not None
+
+    def iter_knowledge(self):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_KNOWLEDGE_FIELDS)} FROM knowledge ORDER BY id").fetchall()
+        return [dict(zip(_KNOWLEDGE_FIELDS, row)) for row in rows]
+
+    def count_knowledge(self, kind, query=None):
+        return self._count("knowledge", "kind = ?", (kind,), query)
+
+    def list_knowledge(self, kind, query=None, limit=20, offset=0):
+        return self._page("knowledge", _KNOWLEDGE_FIELDS, "kind = ?", (kind,), query, limit, offset)
+
+    def add_audit(self, record):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO audits (timestamp, audit_type, region, industry, cached, report) VALUES (?, ?, ?, ?, ?, ?)",
+                (record["timestamp"], record["audit_type"], record["region"], record["industry"],
+                 int(record.get("cached", False)), record["report"]),
+            )
+            self._conn.execute("INSERT INTO audits_fts (rowid, body) VALUES (?, ?)",
+                               (cursor.lastrowid, _fts_text(record["audit_type"], record["report"])))
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def count_audits(self, query=None):
+        return self._count("audits", "1 = 1", (), query)
+
+    def list_audits(self, query=None, limit=20, offset=0):
+        """
+        按时间倒序分页列出审核记录，不包含报告正文
+        """
+        return self._page("audits", _AUDIT_FIELDS, "1 = 1", (), query, limit, offset)
+
+    def get_report(self, audit_id):
+        with self._lock:
+            row = self._conn.execute("SELECT report FROM audits WHERE id = ?", (audit_id,)).fetchone()
+        return row[0] if row else None
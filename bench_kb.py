@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+
+from kb_index import BM25Index
+
+SUBJECTS = ["劳动合同", "社会保险", "个人信息", "数据出境", "增值税", "企业所得税", "排污许可", "商标注册",
+            "专利申请", "加班工资", "试用期", "竞业限制", "消费者权益", "网络安全", "安全生产", "反垄断"]
+ACTIONS = ["应当依法", "不得擅自", "需要备案", "必须公示", "定期评估", "及时报告", "书面告知", "严格限制"]
+REGIONS = ["全国", "长三角地区", "珠三角地区", "京津冀地区", "西部地区", "东北地区"]
+
+
+def make_entries(count, seed=0):
+    """
+    由主题和动作随机组合生成法规条目
+    """
+    rng = np.random.default_rng(seed)
+    entries = []
+    for i in range(count):
+        subjects = rng.choice(SUBJECTS, 3, replace=False)
+        actions = rng.choice(ACTIONS, 3)
+        description = "，".join(f"{s}{a}办理第{rng.integers(1, 500)}项" for s, a in zip(subjects, actions))
+        entries.append({"title": f"《{subjects[0]}管理办法》第{i}号", "region": str(rng.choice(REGIONS)),
+                        "description": description})
+    return entries
+
+
+def substring_match(entries, keyword):
+    return [e for e in entries if keyword in e["description"] or keyword in e["title"]]
+
+
+def main():
+    document = "本公司与员工签订劳动合同，试用期六个月，约定竞业限制两年，加班工资按基本工资计算。" * 40
+    print(f"{'条目数':>8} {'建索引耗时':>10} {'检索耗时':>10} {'子串匹配耗时':>12} {'子串命中数':>10}")
+    for count in (1000, 10000, 100000):
+        entries = make_entries(count)
+
+        start = time.perf_counter()
+        index = BM25Index()
+        for entry in entries:
+            index.add(f"{entry['title']} {entry['region']} {entry['description']}", entry)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = index.search(f"劳动合规 互联网 {document}", k=10)
+        search_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matched = substring_match(entries, "劳动合规")
+        substring_time = time.perf_counter() - start
+
+        print(f"{count:>8} {build_time:>9.3f}s {search_time:>9.4f}s {substring_time:>11.4f}s {len(matched):>10}")
+
+    print()
+    print("检索结果示例：")
+    for entry, score in results[:3]:
+        print(f"  {score:6.2f} {entry['title']} {entry['description']}")
+
+
+if __name__ == "__main__":
+    main()
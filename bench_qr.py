@@ -0,0 +1,75 @@
+import time
+
+import cv2
+import numpy as np
+
+from qr import find_blank_area, find_blank_area_pyramid, find_inner_square, find_inner_square_sampled
+
+
+def make_mask(size, seed=0):
+    """
+    生成一张带有不规则空白区域的二值掩码：一个大圆形空白区，边缘有随机缺口
+    """
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((size, size), np.uint8)
+    cv2.circle(mask, (size // 2, size // 2), size // 3, 255, cv2.FILLED)
+    for _ in range(20):
+        x, y = rng.integers(0, size, 2)
+        cv2.circle(mask, (int(x), int(y)), size // 20, 0, cv2.FILLED)
+    return mask
+
+
+def make_poster(width, height, seed=0):
+    """
+    生成一张带纹理的海报，其中有一块空白区域
+    """
+    rng = np.random.default_rng(seed)
+    poster = rng.integers(0, 200, (height // 8, width // 8, 3), dtype=np.uint8)
+    poster = cv2.resize(poster, (width, height), interpolation=cv2.INTER_NEAREST)
+    cv2.rectangle(poster, (width // 10, height // 2), (width // 10 + width // 3, height // 2 + height // 4),
+                  (255, 255, 255), cv2.FILLED)
+    return poster
+
+
+def is_blank(mask, rect):
+    x, y, w, h = rect
+    return bool(w and mask[y:y+h, x:x+w].all())
+
+
+def main():
+    print(f"{'尺寸':>6} {'采样边长':>8} {'采样空白':>8} {'采样耗时':>10} {'精确边长':>8} {'精确空白':>8} {'精确耗时':>10}")
+    for size in (500, 1000, 2000, 4000):
+        mask = make_mask(size)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contour = max(contours, key=cv2.contourArea)
+
+        start = time.perf_counter()
+        sampled = find_inner_square_sampled(contour)
+        sampled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        exact = find_inner_square(contour, mask)
+        exact_time = time.perf_counter() - start
+
+        print(f"{size:>6} {sampled[2]:>8} {is_blank(mask, sampled)!s:>8} {sampled_time:>9.3f}s "
+              f"{exact[2]:>8} {is_blank(mask, exact)!s:>8} {exact_time:>9.3f}s")
+
+    print()
+    print(f"{'尺寸':>11} {'全分辨率耗时':>12} {'金字塔耗时':>10} {'最大偏差':>8}")
+    for width, height in ((1000, 1400), (2000, 2800), (4000, 5600), (6000, 8400)):
+        poster = make_poster(width, height)
+
+        start = time.perf_counter()
+        full = find_blank_area(poster)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        coarse = find_blank_area_pyramid(poster)
+        coarse_time = time.perf_counter() - start
+
+        deviation = max(abs(a - b) for a, b in zip(full, coarse)) if full and coarse else None
+        print(f"{width:>5}x{height:<5} {full_time:>11.3f}s {coarse_time:>9.3f}s {deviation!s:>8}")
+
+
+if __name__ == "__main__":
+    main()
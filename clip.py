@@ -1,12 +1,18 @@
 import streamlit as st
+import concurrent.futures
+import functools
 import math
+import os
+import tempfile
 from PIL import Image, ImageOps
 
-def create_collage(images, ratio, cols, rows, output_path, fill_method, padding):
+from encoders import PngStreamWriter, encode_image, extension, mime_type
+from image_cache import DecodeCache, content_hash, decode_image, open_image
+
+def cell_size(ratio, cols, rows, padding, total_width=1200):
     """
-    拼接图片成为 cols * rows 的网格，包括最外圈的padding
+    计算单个宫格的宽和高
     """
-    total_width = 1200
     #根据ratio计算出每张图片的高度，("3:4", "1:1", "4:3", "16:9", "9:16")
     w, h = ratio.split(':')
     
@@ -18,8 +24,30 @@ def create_collage(images, ratio, cols, rows, output_path, fill_method, padding)
     available_height = total_height - padding * (rows + 1)  # +1 表示上下的padding
     
     # 获取单个图片的尺寸
-    width = available_width // cols
-    height = available_height // rows
+    return available_width // cols, available_height // rows
+
+
+def prepare_tile(img, width, height, fill_method):
+    """
+    调整图片尺寸以填满宫格
+    """
+    if fill_method == "拉伸":
+        return img.resize((width, height), Image.LANCZOS)
+    elif fill_method == "裁切":
+        return ImageOps.fit(img, (width, height), Image.LANCZOS)
+    return img
+
+
+def create_collage(images, ratio, cols, rows, fill_method, padding, encoder=None, keys=None, tile_cache=None,
+                   workers=None):
+    """
+    拼接图片成为 cols * rows 的网格，包括最外圈的padding，在内存中完成并返回 (编码后的字节, 编码统计)
+    encoder 为传给 encode_image 的编码参数，默认 JPEG。
+    images 中可以是图片，也可以是返回图片的函数（只在需要重新生成宫格时才解码）；
+    同时传入 keys 和 tile_cache 时，宫格按 (key, 宽, 高, 填充方式) 缓存，只改变位置时直接复用。
+    宫格在 workers 个线程中并行解码和缩放（Pillow 重采样会释放 GIL），再按网格顺序粘贴
+    """
+    width, height = cell_size(ratio, cols, rows, padding)
     
     # 计算拼接后的图片尺寸，包含所有padding（包括四周的padding）
     collage_width = width * cols + padding * (cols + 1)
@@ -28,26 +56,29 @@ def create_collage(images, ratio, cols, rows, output_path, fill_method, padding)
     # 创建空白拼接图片（白色背景）
     collage = Image.new('RGB', (collage_width, collage_height), (238, 238, 238))
     
-    # 遍历每张图片进行拼接
-    for i, img in enumerate(images):
-        if i >= rows * cols:  # 超出网格范围的图片不处理
-            break
-            
-        # 计算图片在拼接图片中的位置（考虑外圈padding）
-        x_offset = padding + (i % cols) * (width + padding)
-        y_offset = padding + (i // cols) * (height + padding)
-        
+    def make_tile(i):
         # 调整图片尺寸以填满宫格
-        if fill_method == "拉伸":
-            img = img.resize((width, height), Image.LANCZOS)
-        elif fill_method == "裁切":
-            img = ImageOps.fit(img, (width, height), Image.LANCZOS)
-        
-        # 将调整后的图片粘贴到拼接图片中
-        collage.paste(img, (x_offset, y_offset))
+        img = images[i]
+        load = img if callable(img) else (lambda: img)
+        if tile_cache is not None and keys is not None:
+            return tile_cache.get_or_create((keys[i], width, height, fill_method),
+                                            lambda: prepare_tile(load(), width, height, fill_method))
+        return prepare_tile(load(), width, height, fill_method)
+
+    # 超出网格范围的图片不处理
+    count = min(len(images), rows * cols)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        # 遍历每张图片进行拼接，map 按提交顺序返回结果
+        for i, img in enumerate(executor.map(make_tile, range(count))):
+            # 计算图片在拼接图片中的位置（考虑外圈padding）
+            x_offset = padding + (i % cols) * (width + padding)
+            y_offset = padding + (i // cols) * (height + padding)
+            
+            # 将调整后的图片粘贴到拼接图片中
+            collage.paste(img, (x_offset, y_offset))
     
-    # 保存拼接后的图片
-    collage.save(output_path)
+    # 编码拼接后的图片
+    return encode_image(collage, **(encoder or {"format": "JPEG"}))
 
 # 版本1
 # def calculate_layout(item_count,prefer='横向'):
@@ -98,6 +129,60 @@ def calculate_layout(item_count,prefer='横向'):
  
 
 
+def solve_layout(item_count, total_width, total_height, padding=0, tile_ratio=1.0):
+    """
+    为大图模式选择行列数：允许最后一行留空，使宫格的宽高比最接近 tile_ratio，
+    宽高比相同时选择空格更少的布局。质数数量不会退化成 1×N 的长条
+    """
+    best = None
+    for cols in range(1, item_count + 1):
+        rows = math.ceil(item_count / cols)
+        # 空格超过一整行的布局没有意义
+        if cols * rows - item_count >= cols:
+            continue
+        width = (total_width - padding * (cols + 1)) / cols
+        height = (total_height - padding * (rows + 1)) / rows
+        if width < 1 or height < 1:
+            continue
+        score = (abs(math.log(width / height / tile_ratio)), cols * rows - item_count)
+        if best is None or score < best[0]:
+            best = (score, cols, rows)
+    if best is None:
+        raise ValueError("输出尺寸太小，无法容纳所有图片")
+    return best[1], best[2]
+
+
+def create_contact_sheet(files, fileobj, total_width, total_height, fill_method, padding,
+                         fast_decode=True, compress_level=6):
+    """
+    大图模式：逐行生成条带并写入 PNG，内存只与一行宫格的大小有关，适合上千张图片的联系表。
+    files 为上传文件或路径，返回 (cols, rows, 输出宽, 输出高)
+    """
+    cols, rows = solve_layout(len(files), total_width, total_height, padding)
+    width = (total_width - padding * (cols + 1)) // cols
+    height = (total_height - padding * (rows + 1)) // rows
+    sheet_width = width * cols + padding * (cols + 1)
+    sheet_height = height * rows + padding * (rows + 1)
+
+    writer = PngStreamWriter(fileobj, sheet_width, sheet_height, compress_level)
+    for row in range(rows):
+        # 每个条带包含一行宫格及其上方的padding，最后一行再加上底部的padding
+        strip_height = padding + height + (padding if row == rows - 1 else 0)
+        strip = Image.new('RGB', (sheet_width, strip_height), (238, 238, 238))
+        for col, file in enumerate(files[row * cols:(row + 1) * cols]):
+            img = decode_image(file, reduce_to=(width, height) if fast_decode else None)
+            strip.paste(prepare_tile(img, width, height, fill_method), (padding + col * (width + padding), padding))
+        writer.write(strip)
+    writer.close()
+    return cols, rows, sheet_width, sheet_height
+
+
+@st.cache_resource
+def get_tile_cache():
+    # 宫格缓存跨会话和重新运行共享，按字节预算做 LRU 淘汰
+    return DecodeCache(256 * 1024 * 1024)
+
+
 def main():
     st.title("图片拼接")
     st.write("上传图片，选择拼接方式，并生成对应的宫格图片，生成比例")
@@ -105,18 +190,68 @@ def main():
     # 上传图片
     uploaded_files = st.file_uploader("上传图片", accept_multiple_files=True, type=["jpg", "png", "jpeg"])
 
-    # 选择生成图片比例
-    ratio = st.radio("选择生成图片比例", ("3:4", "1:1", "4:3", "16:9", "9:16"))
+    # 大图模式：自定义输出尺寸，逐行写入PNG，适合上千张图片
+    large_mode = st.checkbox("大图模式（联系表）")
+
+    if large_mode:
+        # 大图模式固定输出 PNG，布局由输出尺寸决定，不使用比例、布局、格式和预设
+        sheet_width = st.number_input("输出宽度", min_value=100, max_value=30000, value=7016)
+        sheet_height = st.number_input("输出高度", min_value=100, max_value=30000, value=9933)
+    else:
+        # 选择生成图片比例
+        ratio = st.radio("选择生成图片比例", ("3:4", "1:1", "4:3", "16:9", "9:16"))
 
     # 选择填充方式
     fill_method = st.radio("选择填充方式", ("裁切", "拉伸"))
 
-    # 选择布局方式
-    prefer_layout = st.radio("选择布局方式", ("纵向", "横向"))
+    if not large_mode:
+        # 选择布局方式
+        prefer_layout = st.radio("选择布局方式", ("纵向", "横向"))
     
     # 选择padding
     padding = st.number_input("选择padding", min_value=0, max_value=100, value=40)
-    if uploaded_files:
+
+    if not large_mode:
+        # 选择输出格式和编码预设
+        output_format = st.radio("选择输出格式", ("JPEG", "PNG", "WEBP", "WEBP_LOSSLESS"))
+        preset = st.radio("选择编码预设", ("default", "fast", "small"))
+
+    # 快速解码：按宫格尺寸缩小解码，关闭后以原始分辨率解码
+    fast_decode = st.checkbox("快速解码", value=True)
+
+    if not large_mode:
+        # 选择并行处理宫格的线程数
+        workers = st.number_input("并行线程数", min_value=1, max_value=64, value=os.cpu_count() or 1)
+
+    if uploaded_files and large_mode:
+        # 联系表只在点击按钮时生成，结果按输入和参数记在会话中，其他控件引起的重新运行直接复用。
+        # 每个会话只保留一个文件，放在会话自己的临时目录中，会话结束、目录对象被回收时连同目录一起删除
+        sheet_key = (tuple(f.file_id for f in uploaded_files), sheet_width, sheet_height, padding, fill_method,
+                     fast_decode)
+        if st.button("生成联系表"):
+            st.session_state.pop("contact_sheet", None)
+            if "contact_sheet_dir" not in st.session_state:
+                st.session_state.contact_sheet_dir = tempfile.TemporaryDirectory(prefix="contact_sheet_")
+            path = os.path.join(st.session_state.contact_sheet_dir.name, "contact_sheet.png")
+            with open(path, "wb") as output:
+                layout = create_contact_sheet(uploaded_files, output, sheet_width, sheet_height, fill_method,
+                                              padding, fast_decode)
+            st.session_state.contact_sheet = {"key": sheet_key, "path": path, "layout": layout}
+
+        sheet = st.session_state.get("contact_sheet")
+        if sheet and sheet["key"] == sheet_key:
+            cols, rows, out_width, out_height = sheet["layout"]
+            try:
+                with open(sheet["path"], "rb") as output:
+                    st.caption(f"{cols} 列 × {rows} 行 · {out_width} × {out_height}")
+                    st.download_button("下载联系表", data=output, file_name="contact_sheet.png",
+                                       mime="image/png", on_click="ignore")
+            except FileNotFoundError:
+                del st.session_state.contact_sheet
+                st.info("联系表文件已被清理，请重新生成联系表")
+        elif sheet:
+            st.info("图片或参数已修改，请重新生成联系表")
+    elif uploaded_files:
         num_images = len(uploaded_files)
 
         # 根据图片数量选择拼接模式和行列数
@@ -131,18 +266,26 @@ def main():
         #     cols, rows = 3, 4
         cols, rows = calculate_layout(num_images,prefer_layout)
 
-        images = []
-        for uploaded_file in uploaded_files:
-            image = Image.open(uploaded_file)
-            images.append(image)
+        # 先计算宫格尺寸，再以不小于宫格的缩小比例解码，最后由 create_collage 做高质量重采样
+        reduce_to = cell_size(ratio, cols, rows, padding) if fast_decode else None
+        if reduce_to and min(reduce_to) <= 0:
+            reduce_to = None
+
+        # 延迟解码，宫格缓存命中时不需要解码
+        images = [functools.partial(open_image, f, reduce_to=reduce_to) for f in uploaded_files]
+        keys = [(content_hash(f), fast_decode) for f in uploaded_files]
 
-        # 生成拼接后的图片
-        collage_output = "collage.jpg"
-        create_collage(images,ratio, cols, rows, collage_output, fill_method, padding)
+        # 在内存中生成拼接后的图片，每个会话各自持有结果，不再写入共享文件
+        collage_output, stats = create_collage(images, ratio, cols, rows, fill_method, padding,
+                                               {"format": output_format, "preset": preset},
+                                               keys=keys, tile_cache=get_tile_cache(), workers=workers)
+        st.caption(f"编码 {stats['time']:.2f}s · 大小 {stats['size'] / 1024:.1f} KB")
 
         # 显示拼接后的图片
         st.image(collage_output, caption='拼接后的图片', use_container_width=True)
         st.text("长按图片下载")
+        st.download_button("下载拼接图片", data=collage_output, file_name=f"collage.{extension(output_format)}",
+                           mime=mime_type(output_format), on_click="ignore")
         # # 提供下载链接
         # st.markdown(get_binary_file_downloader_html(collage_output, '图片下载'), unsafe_allow_html=True)
 
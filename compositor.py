@@ -0,0 +1,394 @@
+from PIL import Image
+import numpy as np
+import collections
+import contextlib
+import concurrent.futures
+import os
+import time
+import zipfile
+import argparse
+from pathlib import Path
+
+from encoders import FORMATS, encode_image, extension
+from image_cache import open_image
+
+# 与 Pillow AlphaComposite.c 保持一致的定点精度
+PRECISION_BITS = 7
+_SCALE = 255 * (1 << PRECISION_BITS)
+
+
+def load_rgba(file):
+    """
+    解码上传的文件并转换为 RGBA，结果按内容哈希缓存，重新运行时不会重复解码
+    """
+    return open_image(file, "RGBA")
+
+
+def prepare_foreground(image):
+    """
+    预先计算前景图像的非透明包围盒、alpha 以及预乘后的颜色，
+    合成时只需要处理包围盒内的像素
+    """
+    bbox = image.getchannel("A").getbbox()
+    prepared = {"size": image.size, "bbox": bbox}
+    if bbox is None:
+        # 完全透明的前景不会改变背景
+        return prepared
+
+    region = np.asarray(image.crop(bbox), dtype=np.uint32)
+    alpha = region[..., 3:4]
+    prepared["rgb"] = region[..., :3]
+    prepared["alpha"] = alpha
+    # 背景不透明时 coef1 = alpha * 128，可以直接预乘
+    prepared["premultiplied"] = region[..., :3] * (alpha << PRECISION_BITS)
+    prepared["transparent"] = alpha[..., 0] == 0
+    return prepared
+
+
+def _shift_div255(value):
+    return ((value >> 8) + value) >> 8
+
+
+def _blend(dst, fg):
+    """
+    按照 Image.alpha_composite 的整数算法把前景混合到 dst（uint8，H×W×4）上
+    """
+    dst_rgb = dst[..., :3].astype(np.uint32)
+    dst_a = dst[..., 3:4].astype(np.uint32)
+    src_a = fg["alpha"]
+
+    if dst_a.min() == 255:
+        # 背景不透明：outa255 恒为 255*255，系数只取决于前景
+        tmp = fg["premultiplied"] + dst_rgb * (_SCALE - (src_a << PRECISION_BITS))
+        out_a = np.full_like(dst_a, 255)
+    else:
+        outa255 = src_a * 255 + dst_a * (255 - src_a)
+        coef1 = src_a * (255 * 255 << PRECISION_BITS) // np.maximum(outa255, 1)
+        tmp = fg["rgb"] * coef1 + dst_rgb * (_SCALE - coef1)
+        out_a = _shift_div255(outa255 + 0x80)
+
+    out_rgb = _shift_div255(tmp + (0x80 << PRECISION_BITS)) >> PRECISION_BITS
+    out = np.concatenate((out_rgb, out_a), axis=2).astype(np.uint8)
+    # alpha 为 0 的前景像素保持背景原样
+    out[fg["transparent"]] = dst[fg["transparent"]]
+    return out
+
+
+def composite(background, fg):
+    """
+    将预处理过的前景居中合成到背景上，返回新的 RGBA Image。
+    background 可以是 RGBA Image，也可以是已经转换好的 H×W×4 数组
+    """
+    canvas = np.array(background, dtype=np.uint8)
+    if fg["bbox"] is not None:
+        height, width = canvas.shape[:2]
+        left, top, right, bottom = fg["bbox"]
+        x = (width - fg["size"][0]) // 2 + left
+        y = (height - fg["size"][1]) // 2 + top
+        region = canvas[y:y + bottom - top, x:x + right - left]
+        region[...] = _blend(region, fg)
+    return Image.fromarray(canvas, "RGBA")
+
+
+def _fit_background(background, fg_size):
+    """
+    如果前景图像比背景图像大，将背景图像扩展到和前景图像一样的大小，
+    与原有逻辑一致，扩展后的背景会继续用于后面的前景
+    """
+    fg_width, fg_height = fg_size
+    if fg_width > background.width or fg_height > background.height:
+        return background.resize((fg_width, fg_height), Image.BICUBIC)
+    return background
+
+
+def _pairs(background, foregrounds):
+    """
+    按顺序为每个前景给出对应的背景数组
+    """
+    base = np.asarray(background)
+    for fg in foregrounds:
+        fitted = _fit_background(background, fg["size"])
+        if fitted is not background:
+            background = fitted
+            base = np.asarray(background)
+        yield base, fg
+
+
+def composite_batch(background_files, foreground_files):
+    """
+    计算背景 × 前景的全部合成结果，按背景在外、前景在内的顺序逐张产出。
+    每个输入只解码一次，M × N 的任务只需要 M + N 次解码
+    """
+    foregrounds = [prepare_foreground(load_rgba(f)) for f in foreground_files]
+
+    for background_file in background_files:
+        for base, fg in _pairs(load_rgba(background_file), foregrounds):
+            yield composite(base, fg)
+
+
+def load_proxy(file, size):
+    """
+    解码一个缩小到 size 以内的代理图像用于预览，同时记录原始尺寸。
+    JPEG 会借助 draft() 以缩小的比例直接解码
+    """
+    img = Image.open(file)
+    original_size = img.size
+    img.draft(None, (size, size))
+    img = img.convert("RGBA")
+    img.thumbnail((size, size))
+    return {"size": original_size, "image": img}
+
+
+def preview_sizes(background_size, foreground_sizes):
+    """
+    只根据尺寸推算每个前景对应的背景尺寸，与 _pairs 中的扩展逻辑一致
+    """
+    width, height = background_size
+    for fg_width, fg_height in foreground_sizes:
+        if fg_width > width or fg_height > height:
+            width, height = fg_width, fg_height
+        yield width, height
+
+
+def composite_preview(background, background_size, foreground, size):
+    """
+    在缩小的尺度上合成一张缩略图，background 和 foreground 为 load_proxy 的结果，
+    background_size 为合成时背景的实际尺寸
+    """
+    scale = size / max(background_size)
+    bg_width = max(1, round(background_size[0] * scale))
+    bg_height = max(1, round(background_size[1] * scale))
+    fg_width = min(bg_width, max(1, round(foreground["size"][0] * scale)))
+    fg_height = min(bg_height, max(1, round(foreground["size"][1] * scale)))
+
+    canvas = background["image"].resize((bg_width, bg_height), Image.BICUBIC)
+    fg_img = foreground["image"].resize((fg_width, fg_height), Image.BICUBIC)
+    position = ((bg_width - fg_width) // 2, (bg_height - fg_height) // 2)
+    canvas.alpha_composite(fg_img, position)
+    return canvas
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _decode_foreground(file):
+    return prepare_foreground(load_rgba(file))
+
+
+def _render(base, fg, encoder):
+    img, composite_time = _timed(composite, base, fg)
+    data, stats = encode_image(img, **encoder)
+    return data, composite_time, stats
+
+
+def ordered_results(executor, func, items, window):
+    """
+    提交任务并按提交顺序取回结果，最多同时保留 window 个未完成的任务
+    """
+    pending = collections.deque()
+    for args in items:
+        pending.append(executor.submit(func, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _init_timings(timings, stages):
+    if timings is None:
+        timings = {}
+    for stage in stages:
+        timings.setdefault(stage, 0)
+    return timings
+
+
+def composite_parallel(background_files, foreground_files, workers=None, timings=None, encoder=None):
+    """
+    在线程池中并行完成解码、合成和编码，按 composite_batch 的顺序逐张产出编码后的字节。
+    Pillow 的解码/编码和 NumPy 运算都会释放 GIL，因此线程即可利用多核。
+    encoder 为传给 encoders.encode_image 的参数，例如 {"format": "WEBP", "preset": "small"}，默认 PNG。
+    传入 timings 字典时，会累计各阶段耗时（秒，各线程之和）、总耗时以及输出字节数
+    """
+    workers = workers or os.cpu_count() or 1
+    encoder = encoder or {}
+    timings = _init_timings(timings, ("decode", "composite", "encode", "total", "bytes"))
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        foregrounds = []
+        decoded = ordered_results(executor, _timed, ((_decode_foreground, f) for f in foreground_files), workers)
+        for fg, decode_time in decoded:
+            foregrounds.append(fg)
+            timings["decode"] += decode_time
+
+        def backgrounds():
+            for background, decode_time in ordered_results(executor, _timed, ((load_rgba, f) for f in background_files), workers):
+                timings["decode"] += decode_time
+                for base, fg in _pairs(background, foregrounds):
+                    yield base, fg, encoder
+
+        for data, composite_time, stats in ordered_results(executor, _render, backgrounds(), workers * 2):
+            timings["composite"] += composite_time
+            timings["encode"] += stats["time"]
+            timings["bytes"] += stats["size"]
+            timings["total"] = time.perf_counter() - start
+            yield data
+    timings["total"] = time.perf_counter() - start
+
+
+def write_zip(images, fileobj, name_format="合成图像 {}.png"):
+    """
+    将合成结果逐张写入 ZIP，写完即释放，不在内存中保留全部结果。
+    images 中可以是 Image（编码为 PNG），也可以是已经编码好的字节。
+    返回写入的图像数量
+    """
+    count = 0
+    with zipfile.ZipFile(fileobj, "w") as zip_file:
+        for count, img in enumerate(images, start=1):
+            name = name_format.format(count)
+            if isinstance(img, bytes):
+                zip_file.writestr(name, img)
+            else:
+                with zip_file.open(name, "w") as entry:
+                    img.save(entry, format="PNG")
+            del img
+    return count
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def list_images(directory):
+    return sorted(p for p in Path(directory).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def output_name(background_file, foreground_file, format="PNG"):
+    return f"{Path(background_file).stem}_{Path(foreground_file).stem}.{extension(format)}"
+
+
+def composite_stream(background_files, foreground_files, skip=None, format="PNG"):
+    """
+    以前景为外层逐个流式读取，产出 (输出文件名, 背景数组, 预处理前景)。
+    只常驻背景图像和当前的一个前景，适合少量背景 × 大量前景的批处理；
+    每对的结果与 composite_batch 相同。skip(name) 为真的输出不再合成，
+    但仍会推进背景的扩展状态，因此断点续跑的结果保持一致
+    """
+    backgrounds = []
+    for background_file in background_files:
+        background = load_rgba(background_file)
+        backgrounds.append([background, np.asarray(background)])
+
+    for foreground_file in foreground_files:
+        names = [output_name(b, foreground_file, format) for b in background_files]
+        needed = [skip is None or not skip(name) for name in names]
+        if any(needed):
+            fg = prepare_foreground(load_rgba(foreground_file))
+            fg_size = fg["size"]
+        else:
+            # 全部已存在时只读取文件头获取尺寸
+            with Image.open(foreground_file) as img:
+                fg_size = img.size
+
+        for state, name, need in zip(backgrounds, names, needed):
+            fitted = _fit_background(state[0], fg_size)
+            if fitted is not state[0]:
+                state[0], state[1] = fitted, np.asarray(fitted)
+            if need:
+                yield name, state[1], fg
+
+
+def _render_named(name, base, fg, encoder):
+    return (name,) + _render(base, fg, encoder)
+
+
+def _write_file(path, data):
+    # 先写临时文件再改名，中断时不会留下被误认为已完成的半截文件
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def _zip_names(path):
+    """
+    已写入压缩包的文件名。被强行中断的压缩包没有中央目录，无法读取，视为没有进度
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return set(archive.namelist())
+    except (FileNotFoundError, zipfile.BadZipFile):
+        return set()
+
+
+def run_batch(background_dir, foreground_dir, output, workers=None, resume=True, timings=None, encoder=None):
+    """
+    合成两个目录中全部 背景 × 前景 的组合，结果写入目录或 .zip 文件。
+    resume 为真时跳过已经存在的输出。返回本次写入的图像数量
+    """
+    workers = workers or os.cpu_count() or 1
+    encoder = encoder or {}
+    timings = _init_timings(timings, ("composite", "encode", "total", "bytes"))
+
+    output = Path(output)
+    to_zip = output.suffix.lower() == ".zip"
+    if to_zip:
+        # 压缩包先写到 .part 文件，全部完成后再改名，中断后留下的不会被当作完整的结果
+        part = output.with_suffix(".part")
+        if resume and not part.exists() and output.exists():
+            os.replace(output, part)
+        existing = _zip_names(part) if resume else set()
+    else:
+        output.mkdir(parents=True, exist_ok=True)
+        existing = {p.name for p in output.iterdir()} if resume else set()
+
+    pairs = composite_stream(list_images(background_dir), list_images(foreground_dir),
+                             skip=existing.__contains__, format=encoder.get("format", "PNG"))
+    tasks = ((name, base, fg, encoder) for name, base, fg in pairs)
+
+    start = time.perf_counter()
+    count = 0
+    with contextlib.ExitStack() as stack:
+        zip_file = stack.enter_context(zipfile.ZipFile(part, "a" if existing else "w")) if to_zip else None
+        executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers=workers))
+        for name, data, composite_time, stats in ordered_results(executor, _render_named, tasks, workers * 2):
+            if to_zip:
+                zip_file.writestr(name, data)
+            else:
+                _write_file(output / name, data)
+            timings["composite"] += composite_time
+            timings["encode"] += stats["time"]
+            timings["bytes"] += stats["size"]
+            count += 1
+    if to_zip:
+        os.replace(part, output)
+    timings["total"] = time.perf_counter() - start
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将前景目录中的每张图像居中叠加到背景目录中的每张图像上")
+    parser.add_argument("backgrounds", help="背景图像目录")
+    parser.add_argument("foregrounds", help="前景图像目录")
+    parser.add_argument("output", help="输出目录，或以 .zip 结尾的压缩包路径")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="并行线程数，默认为 CPU 核数")
+    parser.add_argument("--no-resume", action="store_true", help="不跳过已经存在的输出")
+    parser.add_argument("--format", choices=list(FORMATS), default="PNG", help="输出格式")
+    parser.add_argument("--preset", choices=("fast", "default", "small"), default="default", help="编码预设")
+    parser.add_argument("--quality", type=int, default=None, help="JPEG/WEBP 质量，覆盖预设")
+    args = parser.parse_args()
+
+    encoder = {"format": args.format, "preset": args.preset}
+    if args.quality is not None:
+        encoder["quality"] = args.quality
+
+    timings = {}
+    count = run_batch(args.backgrounds, args.foregrounds, args.output, args.workers,
+                      resume=not args.no_resume, timings=timings, encoder=encoder)
+    print(f"已生成 {count} 张图像，合成 {timings['composite']:.2f}s，编码 {timings['encode']:.2f}s，"
+          f"总耗时 {timings['total']:.2f}s，输出 {timings['bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import io
+import struct
+import time
+import zlib
+
+import numpy as np
+
+# 输出格式对应的 Pillow 格式、扩展名和 MIME 类型
+FORMATS = {
+    "PNG": {"format": "PNG", "extension": "png", "mime": "image/png"},
+    "JPEG": {"format": "JPEG", "extension": "jpg", "mime": "image/jpeg"},
+    "WEBP": {"format": "WEBP", "extension": "webp", "mime": "image/webp"},
+    "WEBP_LOSSLESS": {"format": "WEBP", "extension": "webp", "mime": "image/webp"},
+}
+
+# 速度/体积预设，default 与 Pillow 的默认参数一致
+PRESETS = {
+    "PNG": {
+        "fast": {"compress_level": 1},
+        "default": {},
+        "small": {"optimize": True},
+    },
+    "JPEG": {
+        # Pillow 的默认参数（quality 75，不做 optimize 和 progressive）已经是最快的编码方式
+        "fast": {},
+        "default": {},
+        "small": {"quality": 70, "optimize": True, "progressive": True},
+    },
+    "WEBP": {
+        "fast": {"quality": 85, "method": 0},
+        "default": {},
+        "small": {"quality": 70, "method": 6},
+    },
+    "WEBP_LOSSLESS": {
+        "fast": {"lossless": True, "quality": 0, "method": 0},
+        "default": {"lossless": True},
+        "small": {"lossless": True, "quality": 100, "method": 6},
+    },
+}
+
+
+def encoder_options(format="PNG", preset="default", **overrides):
+    """
+    合并预设和自定义参数，例如 encoder_options("JPEG", "small", quality=60)
+    """
+    options = dict(PRESETS[format][preset])
+    options.update(overrides)
+    return options
+
+
+def extension(format):
+    return FORMATS[format]["extension"]
+
+
+def mime_type(format):
+    return FORMATS[format]["mime"]
+
+
+def encode_image(img, format="PNG", preset="default", **overrides):
+    """
+    按指定格式和预设编码图像，返回 (字节, 统计信息)，统计信息包含编码耗时（秒）和输出大小（字节）
+    """
+    options = encoder_options(format, preset, **overrides)
+    if format == "JPEG" and img.mode not in ("RGB", "L"):
+        # JPEG 不支持透明通道
+        img = img.convert("RGB")
+
+    start = time.perf_counter()
+    with io.BytesIO() as buffer:
+        img.save(buffer, format=FORMATS[format]["format"], **options)
+        data = buffer.getvalue()
+    return data, {"format": format, "preset": preset, "time": time.perf_counter() - start, "size": len(data)}
+
+
+class PngStreamWriter:
+    """
+    逐条写入 RGB 像素行的 PNG 编码器，内存只与当前写入的条带大小有关，
+    用于无法一次性分配整张画布的超大图像。每行使用 Sub 过滤
+    """
+
+    def __init__(self, fileobj, width, height, compress_level=6):
+        self.fileobj = fileobj
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        fileobj.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        self.fileobj.write(struct.pack(">I", len(data)) + tag + data)
+        self.fileobj.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def write(self, strip):
+        """
+        写入一个宽度为 width 的 RGB 条带
+        """
+        rows = np.asarray(strip.convert("RGB"), dtype=np.uint8)
+        if rows.shape[1] != self.width or self.rows_written + rows.shape[0] > self.height:
+            raise ValueError("条带尺寸与 PNG 图像尺寸不一致")
+
+        filtered = np.empty((rows.shape[0], self.width * 3 + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        flat = rows.reshape(rows.shape[0], -1)
+        filtered[:, 1:4] = flat[:, :3]
+        filtered[:, 4:] = flat[:, 3:] - flat[:, :-3]
+
+        data = self._compressor.compress(filtered.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG 需要 {self.height} 行，实际写入 {self.rows_written} 行")
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
@@ -0,0 +1,126 @@
+from PIL import Image
+import collections
+import hashlib
+import io
+import os
+import threading
+
+
+class DecodeCache:
+    """
+    以上传内容的 SHA-256 和转换模式为键缓存解码后的图像，
+    按字节预算做 LRU 淘汰，Streamlit 重新运行时输入不变即可跳过解码。
+    缓存中的图像是共享的，调用方不能原地修改
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file, mode=None, reduce_to=None):
+        data = _read_bytes(file)
+        key = (hashlib.sha256(data).hexdigest(), mode, reduce_to)
+        return self.get_or_create(key, lambda: _decode(data, mode, reduce_to))
+
+    def get_or_create(self, key, factory):
+        """
+        命中时直接返回缓存的图像，否则调用 factory() 生成并放入缓存
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        img = factory()
+        self._put(key, img)
+        return img
+
+    def _put(self, key, img):
+        size = img.width * img.height * len(img.getbands())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = img
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+            }
+
+
+def content_hash(file):
+    return hashlib.sha256(_read_bytes(file)).hexdigest()
+
+
+def _read_bytes(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+
+def _decode(data, mode, reduce_to):
+    img = Image.open(io.BytesIO(data))
+    if reduce_to:
+        img = _decode_reduced(img, reduce_to)
+    img = img.convert(mode) if mode else img
+    img.load()
+    return img
+
+
+def _decode_reduced(img, size):
+    """
+    以不小于 size 的缩小比例解码：JPEG 通过 draft() 在 DCT 阶段直接缩小，
+    其余格式解码后再用 reduce() 做整数倍缩小，最终的高质量重采样由调用方完成
+    """
+    img.draft(None, size)
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        if img.mode not in ("L", "LA", "RGB", "RGBA", "CMYK"):
+            img = img.convert("RGBA" if "transparency" in img.info or "A" in img.mode else "RGB")
+        img = img.reduce(factor)
+    return img
+
+
+def decode_image(file, mode=None, reduce_to=None):
+    """
+    不经过缓存直接解码，用于只使用一次的大批量输入
+    """
+    return _decode(_read_bytes(file), mode, reduce_to)
+
+
+# 模块级缓存在 Streamlit 的多次重新运行之间保持不变，预算可通过 IMAGE_CACHE_MB 调整
+decode_cache = DecodeCache(int(os.getenv("IMAGE_CACHE_MB", "512")) * 1024 * 1024)
+
+
+def open_image(file, mode=None, reduce_to=None):
+    """
+    通过共享缓存解码图像，reduce_to 为 (宽, 高) 时以不小于该尺寸的缩小比例解码
+    """
+    return decode_cache.get(file, mode, reduce_to)
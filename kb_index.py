@@ -0,0 +1,117 @@
+import collections
+import math
+import re
+from array import array
+
+import numpy as np
+
+_TOKEN = re.compile(r"[一-鿿]+|[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    中文按相邻两字切分（单字的词保留单字），英文和数字按整词切分
+    """
+    tokens = []
+    for run in _TOKEN.findall(text.lower()):
+        if "一" <= run[0] <= "鿿" and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """
+    增量构建的 BM25 倒排索引。每个词的倒排表是紧凑的 array，检索时直接映射成 NumPy 数组做向量化打分。
+    删除只做标记，被删除的条目不再出现在结果中，但仍计入文档频率
+    """
+
+    def __init__(self, k1=1.5, b=0.75, max_query_terms=256):
+        self.k1 = k1
+        self.b = b
+        self.max_query_terms = max_query_terms
+        self.count = 0
+        self._postings = {}
+        self._lengths = array("f")
+        self._live = bytearray()
+        self._payloads = []
+        self._total_length = 0
+
+    def add(self, text, payload=None):
+        """
+        添加一条文本，返回它的编号
+        """
+        doc_id = len(self._payloads)
+        counts = collections.Counter(tokenize(text))
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("q"), array("f"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+
+        length = sum(counts.values())
+        self._lengths.append(length)
+        self._live.append(1)
+        self._payloads.append(payload)
+        self._total_length += length
+        self.count += 1
+        return doc_id
+
+    def remove(self, doc_id):
+        if self._live[doc_id]:
+            self._live[doc_id] = 0
+            self._total_length -= self._lengths[doc_id]
+            self.count -= 1
+
+    def _query_terms(self, query):
+        """
+        查询中出现在索引里的词及其 idf；长文档作查询时只保留 idf 最高的 max_query_terms 个词
+        """
+        terms = []
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is not None:
+                df = len(postings[0])
+                terms.append((math.log(1 + (len(self._payloads) - df + 0.5) / (df + 0.5)), term))
+        terms.sort(reverse=True)
+        return terms[:self.max_query_terms]
+
+    def scores(self, query):
+        """
+        返回所有条目的 BM25 得分数组，下标为条目编号
+        """
+        scores = np.zeros(len(self._payloads), dtype=np.float32)
+        if not self.count:
+            return scores
+
+        lengths = np.frombuffer(self._lengths, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / self.count or 1))
+        for idf, term in self._query_terms(query):
+            ids, tf = self._postings[term]
+            ids = np.frombuffer(ids, dtype=np.int64)
+            tf = np.frombuffer(tf, dtype=np.float32)
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm[ids])
+
+        scores[np.frombuffer(self._live, dtype=np.uint8) == 0] = 0
+        return scores
+
+    def search(self, query, k=10, where=None):
+        """
+        返回得分最高的 k 条 [(payload, 得分)]，where(payload) 为假的条目被跳过
+        """
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)
+        if where is None and len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        results = []
+        for doc_id in candidates:
+            payload = self._payloads[doc_id]
+            if where is None or where(payload):
+                results.append((payload, float(scores[doc_id])))
+                if len(results) == k:
+                    break
+        return results
@@ -0,0 +1,94 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 本地模拟的 DeepSeek 对话接口，用于在没有 API 密钥的情况下测试审核流程：
+#   python mock_deepseek.py --port 8000 --fail-first 2
+#   DEEPSEEK_API_BASE=http://127.0.0.1:8000/v1 streamlit run audit.py
+
+REPLY = """## 摘要
+模拟审核报告：未连接真实模型，以下内容仅用于测试。
+
+## 详细分析
+1. 风险点：劳动合同未约定试用期工资（风险等级：中）
+2. 风险点：加班费计算基数低于法定标准（风险等级：高）
+
+## 结论
+整体风险评分：62/100
+"""
+
+
+def make_handler(latency, token_delay, fail_first):
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                number = next(counter)
+
+            if number <= fail_first:
+                # 模拟限流，检验客户端的退避重试
+                self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "1"})
+                return
+
+            time.sleep(latency)
+            if body.get("stream"):
+                self._send_stream()
+            else:
+                self._send_json(200, {"choices": [{"message": {"role": "assistant", "content": REPLY}}]})
+
+        def _send_json(self, status, data, headers=None):
+            payload = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(REPLY), 4):
+                chunk = {"choices": [{"delta": {"content": REPLY[i:i + 4]}}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                time.sleep(token_delay)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟 DeepSeek 对话接口")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="返回首个字之前的等待时间（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="流式输出时每段文本之间的间隔（秒）")
+    parser.add_argument("--fail-first", type=int, default=0, help="前 N 个请求返回 429")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port),
+                                 make_handler(args.latency, args.token_delay, args.fail_first))
+    print(f"模拟接口已启动：DEEPSEEK_API_BASE=http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,79 @@ import cv2
 import numpy as np
 from PIL import Image
 
+import math
+import os
 import random
+import tempfile
+import zipfile
 
-def find_inner_square(contour, iterations=1000):
+from image_cache import content_hash, open_image
+
+def _run_lengths(mask, axis):
+    """
+    每个像素沿 axis 方向（向上/向左）连续为真的像素个数，包括自身
+    """
+    n = mask.shape[axis]
+    shape = [1, 1]
+    shape[axis] = n
+    index = np.arange(1, n + 1, dtype=np.int32).reshape(shape)
+    last_false = np.maximum.accumulate(np.where(mask, 0, index), axis=axis)
+    return index - last_false
+
+
+def square_map(mask):
+    """
+    dp[i][j] 为以 (j, i) 为右下角、全为真的最大正方形边长。
+    dp[i][j] = min(dp[i-1][j-1] + 1, 向上连续长度, 向左连续长度)，逐行向量化计算，复杂度 O(像素数)
+    """
+    mask = mask.astype(bool)
+    up = _run_lengths(mask, 0)
+    left = _run_lengths(mask, 1)
+    limit = np.minimum(up, left)
+
+    dp = np.empty_like(limit)
+    dp[0] = limit[0]
+    for i in range(1, mask.shape[0]):
+        dp[i, 0] = limit[i, 0]
+        np.minimum(limit[i, 1:], dp[i - 1, :-1] + 1, out=dp[i, 1:])
+    return dp
+
+
+def largest_square(mask):
+    """
+    求二值掩码中全为真的最大正方形，返回 (x, y, 边长)
+    """
+    if not mask.any():
+        return 0, 0, 0
+    dp = square_map(mask)
+    i, j = np.unravel_index(np.argmax(dp), dp.shape)
+    side = int(dp[i, j])
+    return int(j) - side + 1, int(i) - side + 1, side
+
+
+def find_inner_square(contour, mask=None):
+    """
+    确定性地求轮廓内最大的轴对齐正方形，返回 (x, y, w, h)。
+    传入 mask（如腐蚀后的二值图）时，正方形还必须完全落在 mask 的非零区域内
+    """
+    x, y, region = _contour_region(contour, mask)
+    square_x, square_y, side = largest_square(region)
+    return x + square_x, y + square_y, side, side
+
+
+def _contour_region(contour, mask=None):
+    x, y, w, h = cv2.boundingRect(contour)
+    region = np.zeros((h, w), np.uint8)
+    cv2.drawContours(region, [contour], -1, 255, cv2.FILLED, offset=(-x, -y))
+    if mask is not None:
+        region &= mask[y:y+h, x:x+w]
+    return x, y, region
+
+
+def find_inner_square_sampled(contour, iterations=1000):
+    """
+    原有的蒙特卡洛采样实现，结果随机且不一定是最大值，仅用于和 find_inner_square 对比
+    """
     x, y, w, h = cv2.boundingRect(contour)
 
     max_square_side = 0
@@ -32,68 +102,458 @@ def find_inner_square(contour, iterations=1000):
 
     return max_square_x, max_square_y, max_square_side, max_square_side
 
-def find_blank_area(img, threshold=250, min_area=1000, aspect_ratio_tolerance=0.2, avg_white_threshold=250):
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+# 空白区域检测按阶段拆分：灰度 → 阈值 → 形态学 → 轮廓 → 正方形搜索 → 选择，
+# 每个阶段只依赖前一阶段的结果和自己用到的参数，便于分阶段缓存
+
+def to_gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def threshold_mask(gray_img, threshold=250):
     _, thresh = cv2.threshold(gray_img, threshold, 255, cv2.THRESH_BINARY)
+    return thresh
 
+
+def morphology(thresh):
     kernel = np.ones((3, 3), np.uint8)
     dilation = cv2.dilate(thresh, kernel, iterations=1)
     # st.image(dilation, caption="膨胀操作后的图像", use_column_width=True)
 
     erosion = cv2.erode(dilation, kernel, iterations=1)
     # st.image(erosion, caption="腐蚀操作后的图像", use_column_width=True)
+    return erosion
+
+
+def blank_mask(gray_img, threshold=250):
+    return morphology(threshold_mask(gray_img, threshold))
 
+
+def find_contours(erosion):
     contours, _ = cv2.findContours(erosion, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def draw_contours(img, contours):
+    """
+    调试用：在图像副本上画出找到的轮廓
+    """
     contour_img = img.copy()
     cv2.drawContours(contour_img, contours, -1, (0, 255, 0), 8)
-    # st.image(contour_img, caption="找到的轮廓", use_column_width=True)
+    return contour_img
 
-    max_area = 0
-    max_rect = None
+
+def inner_squares(contours, erosion, min_area=1000):
+    """
+    对面积大于 min_area 的轮廓求最大空白正方形，返回 [(轮廓面积, (x, y, w, h)), ...]
+    """
+    squares = []
     for contour in contours:
         area = cv2.contourArea(contour)
         if area > min_area:
-            rect = find_inner_square(contour)
-            x, y, w, h = rect
-            aspect_ratio = float(w) / h
-            if (1 - aspect_ratio_tolerance) <= aspect_ratio <= (1 + aspect_ratio_tolerance):
-                # 检查轮廓区域内的内容是否主要为空白
-                roi = gray_img[y:y+h, x:x+w]
-                avg_value = np.mean(roi)
-                if avg_value > avg_white_threshold:
-                    if area > max_area:
-                        max_area = area
-                        max_rect = rect
+            rect = find_inner_square(contour, erosion)
+            if rect[3] > 0:
+                squares.append((area, rect))
+    return squares
+
+
+def select_blank_area(squares, scorer, aspect_ratio_tolerance=0.2, avg_white_threshold=250):
+    """
+    在满足宽高比和空白程度的正方形中，选择所在轮廓面积最大的一个
+    """
+    max_area = 0
+    max_rect = None
+    for area, rect in squares:
+        x, y, w, h = rect
+        aspect_ratio = float(w) / h
+        if (1 - aspect_ratio_tolerance) <= aspect_ratio <= (1 + aspect_ratio_tolerance):
+            # 检查轮廓区域内的内容是否主要为空白
+            avg_value = scorer.mean(x, y, w, h)
+            if avg_value > avg_white_threshold:
+                if area > max_area:
+                    max_area = area
+                    max_rect = rect
 
     return max_rect
 
 
+class RectScorer:
+    """
+    基于积分图（summed-area table）的矩形统计，任意矩形的均值和方差都是 O(1)，
+    x, y, w, h 可以是数组，一次批量计算大量候选
+    """
+
+    def __init__(self, gray_img):
+        self.gray_img = gray_img
+        self.sum = None
+        self.sqsum = None
+
+    @staticmethod
+    def _box(table, x, y, w, h):
+        return table[y + h, x + w] - table[y, x + w] - table[y + h, x] + table[y, x]
+
+    def mean(self, x, y, w, h):
+        # 只需要均值时不计算平方积分图，可以省下一大半的构建时间
+        if self.sum is None:
+            self.sum = cv2.integral(self.gray_img, sdepth=cv2.CV_64F)
+        return self._box(self.sum, x, y, w, h) / (np.asarray(w) * h)
+
+    def stats(self, x, y, w, h):
+        if self.sqsum is None:
+            self.sum, self.sqsum = cv2.integral2(self.gray_img, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        area = np.asarray(w, dtype=np.float64) * h
+        mean = self._box(self.sum, x, y, w, h) / area
+        variance = np.maximum(self._box(self.sqsum, x, y, w, h) / area - mean * mean, 0)
+        return mean, variance
+
+
+def find_blank_area(img, threshold=250, min_area=1000, aspect_ratio_tolerance=0.2, avg_white_threshold=250):
+    gray_img = to_gray(img)
+    erosion = blank_mask(gray_img, threshold)
+    squares = inner_squares(find_contours(erosion), erosion, min_area)
+    return select_blank_area(squares, RectScorer(gray_img), aspect_ratio_tolerance, avg_white_threshold)
+
+
+def find_blank_candidates(img, k=5, threshold=250, min_area=1000, avg_white_threshold=250,
+                          max_per_contour=2000, max_overlap=0.3):
+    """
+    返回得分最高的 k 个互不大量重叠的放置位置，每个为 {"rect", "mean", "variance", "score"}，按得分降序。
+    每个空白像素都对应一个以它为右下角的最大正方形，每个轮廓取边长最大的 max_per_contour 个作为候选，
+    用积分图批量计算均值和方差。得分为面积按纹理（标准差）折减：side² / (1 + std)，
+    均值不高于 avg_white_threshold 的候选被丢弃
+    """
+    gray_img = to_gray(img)
+    erosion = blank_mask(gray_img, threshold)
+    squares = candidate_squares(find_contours(erosion), erosion, min_area, max_per_contour)
+    return rank_candidates(squares, RectScorer(gray_img), k, avg_white_threshold, max_overlap)
+
+
+def candidate_squares(contours, erosion, min_area=1000, max_per_contour=2000):
+    """
+    每个面积大于 min_area 的轮廓取边长最大的 max_per_contour 个正方形，返回 (xs, ys, sides) 三个数组
+    """
+    xs, ys, sides = [], [], []
+    for contour in contours:
+        if cv2.contourArea(contour) <= min_area:
+            continue
+        x, y, region = _contour_region(contour, erosion)
+        dp = square_map(region).ravel()
+        count = min(max_per_contour, dp.size)
+        top = np.argpartition(dp, dp.size - count)[dp.size - count:]
+        top = top[dp[top] > 0]
+        rows, cols = np.unravel_index(top, region.shape)
+        side = dp[top]
+        xs.append(x + cols - side + 1)
+        ys.append(y + rows - side + 1)
+        sides.append(side)
+    if not sides:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(xs), np.concatenate(ys), np.concatenate(sides)
+
+
+def rank_candidates(squares, scorer, k=5, avg_white_threshold=250, max_overlap=0.3):
+    """
+    对 candidate_squares 的结果打分、过滤并做非极大值抑制，返回值同 find_blank_candidates
+    """
+    xs, ys, sides = squares
+    if not len(sides):
+        return []
+    mean, variance = scorer.stats(xs, ys, sides, sides)
+    score = sides.astype(np.float64) ** 2 / (1 + np.sqrt(variance))
+    keep = mean > avg_white_threshold
+    order = np.flatnonzero(keep)[np.argsort(-score[keep], kind="stable")]
+
+    # 贪心非极大值抑制，保证返回的候选彼此是不同的位置
+    results = []
+    for i in order:
+        rect = (int(xs[i]), int(ys[i]), int(sides[i]), int(sides[i]))
+        if all(_overlap(rect, other["rect"]) <= max_overlap for other in results):
+            results.append({"rect": rect, "mean": float(mean[i]), "variance": float(variance[i]),
+                            "score": float(score[i])})
+            if len(results) == k:
+                break
+    return results
+
+
+def _overlap(a, b):
+    """
+    两个矩形的交集占较小矩形面积的比例
+    """
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    return width * height / min(a[2] * a[3], b[2] * b[3])
+
+
+def find_blank_area_pyramid(img, max_side=1024, tolerance=4, threshold=250, min_area=1000,
+                            aspect_ratio_tolerance=0.2, avg_white_threshold=250):
+    """
+    先在缩小到 max_side 以内的图像上找到空白区域，再只在该区域附近（外扩 tolerance 像素及缩放误差）
+    以原始分辨率精确求最大空白正方形。检测耗时基本不再随图像像素数增长
+    """
+    scale, small = pyramid_level(img, max_side)
+    if small is None:
+        return find_blank_area(img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold)
 
+    rect = find_blank_area(small, threshold, min_area * scale * scale, aspect_ratio_tolerance, avg_white_threshold)
+    if rect is None:
+        return None
+    # 粗略解附近找不到满足条件的正方形时退回到全分辨率检测
+    return (refine_blank_area(img, rect, scale, tolerance, threshold, avg_white_threshold)
+            or find_blank_area(img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold))
 
-def overlay_images(bg_img, fg_img, x, y, w, h):
+
+def pyramid_level(img, max_side=1024):
+    """
+    返回 (缩放比例, 缩小后的图像)，图像本身不超过 max_side 时缩小后的图像为 None
+    """
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return scale, None
+    # 线性插值只采样少量像素，耗时几乎与原图大小无关；漏掉的细小内容会在原始分辨率的精修中被发现
+    return scale, cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+
+
+def refine_blank_area(img, rect, scale, tolerance=4, threshold=250, avg_white_threshold=250, gray_img=None):
+    """
+    把缩小图像上找到的空白区域 rect 映射回原始分辨率并精修，返回 (x, y, w, h)，不满足条件时返回 None。
+    gray_img 为原图的灰度图，已有时传入直接截取，否则只转换需要的区域
+    """
+    height, width = img.shape[:2]
+    # 缩放会带来约 1/scale 像素的边界误差，在此基础上再外扩 tolerance
+    x, y, w, h = rect
+    margin = math.ceil(2 / scale) + tolerance
+    left = max(0, math.floor(x / scale) - margin)
+    top = max(0, math.floor(y / scale) - margin)
+    right = min(width, math.ceil((x + w) / scale) + margin)
+    bottom = min(height, math.ceil((y + h) / scale) + margin)
+
+    if gray_img is not None:
+        gray_roi = gray_img[top:bottom, left:right]
+    else:
+        gray_roi = cv2.cvtColor(img[top:bottom, left:right], cv2.COLOR_BGR2GRAY)
+    mask = blank_mask(gray_roi, threshold)
+    guess = (math.floor(x / scale) - left, math.floor(y / scale) - top, math.ceil(w / scale))
+    square = refine_square(mask, *guess, margin)
+
+    # 精修结果是正方形，宽高比条件自然满足；空白程度在原始分辨率上用积分图重新检查
+    if square is not None:
+        square_x, square_y, side = square
+        if RectScorer(gray_roi).mean(square_x, square_y, side, side) > avg_white_threshold:
+            return left + square_x, top + square_y, side, side
+    return None
+
+
+def refine_square(mask, x, y, side, margin):
+    """
+    在粗略解 (x, y, side) 附近 ±margin 的范围内，借助积分图以 O(1) 判断每个候选正方形是否全为空白，
+    从大到小搜索边长，只检查边界附近的候选位置，返回 (x, y, 边长)。
+    边长和位置都不超出粗略解 ±margin 的范围，找不到时返回 None
+    """
+    height, width = mask.shape
+    # 积分图统计非空白像素个数
+    integral = cv2.integral((mask == 0).astype(np.uint8))
+    xs = np.arange(max(0, x - margin), x + margin + 1)
+    ys = np.arange(max(0, y - margin), y + margin + 1)[:, None]
+
+    for size in range(min(side + 2 * margin, height, width), max(side - 2 * margin, 1) - 1, -1):
+        valid_x = xs[xs + size <= width]
+        valid_y = ys[ys + size <= height][:, None]
+        if not len(valid_x) or not len(valid_y):
+            continue
+        dirty = (integral[valid_y + size, valid_x + size] - integral[valid_y, valid_x + size]
+                 - integral[valid_y + size, valid_x] + integral[valid_y, valid_x])
+        if (dirty == 0).any():
+            row, col = np.argwhere(dirty == 0)[0]
+            return int(valid_x[col]), int(valid_y[row, 0]), size
+
+    return None
+
+
+def qr_size(fg_size, w, h):
     # 保持前景图片的宽高比
-    fg_width, fg_height = fg_img.size
+    fg_width, fg_height = fg_size
     ratio = min(w / fg_width, h / fg_height)
-    new_fg_size = (int(fg_width * ratio), int(fg_height * ratio))
-    
-    fg_img = fg_img.resize(new_fg_size, Image.ANTIALIAS)
+    return int(fg_width * ratio), int(fg_height * ratio)
+
+
+def overlay_images(bg_img, fg_img, x, y, w, h, resized=None):
+    """
+    将二维码缩放后居中贴到空白区域，resized 为已经缩放好的二维码时直接使用
+    """
+    new_fg_size = qr_size(fg_img.size, w, h)
+    fg_img = resized or fg_img.resize(new_fg_size, Image.LANCZOS)
     bg_img.paste(fg_img, (x + w // 2 - new_fg_size[0] // 2, y + h // 2 - new_fg_size[1] // 2), fg_img)
     return bg_img
 
-st.title("二维码自动叠加")
 
-bg_img_file = st.file_uploader("请选择背景图片", type=["jpg", "jpeg", "png"])
-fg_img_file = st.file_uploader("请选择二维码图片", type=["jpg", "jpeg", "png"])
+# 以下缓存以图像内容哈希和各阶段实际用到的参数为键，调整某个参数时只重新计算它之后的阶段。
+# 以下划线开头的参数不参与缓存键的计算
+@st.cache_resource(max_entries=4)
+def cached_bgr(image_key, _img):
+    return cv2.cvtColor(np.array(_img), cv2.COLOR_RGBA2BGR)
+
+
+@st.cache_resource(max_entries=8)
+def cached_gray(image_key, _img):
+    return to_gray(_img)
+
+
+@st.cache_resource(max_entries=8)
+def cached_scorer(image_key, _img):
+    return RectScorer(cached_gray(image_key, _img))
+
+
+@st.cache_resource(max_entries=16)
+def cached_threshold(image_key, threshold, _img):
+    return threshold_mask(cached_gray(image_key, _img), threshold)
+
+
+@st.cache_resource(max_entries=16)
+def cached_morphology(image_key, threshold, _img):
+    return morphology(cached_threshold(image_key, threshold, _img))
+
+
+@st.cache_resource(max_entries=16)
+def cached_contours(image_key, threshold, _img):
+    return find_contours(cached_morphology(image_key, threshold, _img))
 
-if bg_img_file is not None and fg_img_file is not None:
-    bg_img = Image.open(bg_img_file).convert("RGBA")
-    fg_img = Image.open(fg_img_file).convert("RGBA")
-    bg_img_cv2 = cv2.cvtColor(np.array(bg_img), cv2.COLOR_RGBA2BGR)
 
-    blank_area = find_blank_area(bg_img_cv2)
-    if blank_area:
-        x, y, w, h = blank_area
-        result_img = overlay_images(bg_img, fg_img, x, y, w, h)
-        st.image(result_img, caption="叠加后的图片", use_column_width=True)
+@st.cache_resource(max_entries=32)
+def cached_squares(image_key, threshold, min_area, _img):
+    return inner_squares(cached_contours(image_key, threshold, _img),
+                         cached_morphology(image_key, threshold, _img), min_area)
+
+
+def staged_blank_area(image_key, img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold):
+    squares = cached_squares(image_key, threshold, min_area, img)
+    return select_blank_area(squares, cached_scorer(image_key, img), aspect_ratio_tolerance, avg_white_threshold)
+
+
+@st.cache_resource(max_entries=4)
+def cached_pyramid_level(image_key, _img):
+    return pyramid_level(_img)
+
+
+def staged_pyramid(image_key, img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold):
+    """
+    金字塔检测的各阶段同样分阶段缓存：缩小后的图像以 image_key + ":small" 为键走同一套缓存，
+    精修时从缓存的原图灰度图中截取区域
+    """
+    scale, small = cached_pyramid_level(image_key, img)
+    if small is None:
+        return staged_blank_area(image_key, img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold)
+
+    rect = staged_blank_area(f"{image_key}:small", small, threshold, min_area * scale * scale,
+                             aspect_ratio_tolerance, avg_white_threshold)
+    if rect is None:
+        return None
+    return (refine_blank_area(img, rect, scale, threshold=threshold, avg_white_threshold=avg_white_threshold,
+                              gray_img=cached_gray(image_key, img))
+            or staged_blank_area(image_key, img, threshold, min_area, aspect_ratio_tolerance, avg_white_threshold))
+
+
+@st.cache_resource(max_entries=32)
+def cached_candidate_squares(image_key, threshold, min_area, _img):
+    return candidate_squares(cached_contours(image_key, threshold, _img),
+                             cached_morphology(image_key, threshold, _img), min_area)
+
+
+def staged_candidates(image_key, img, threshold, min_area, avg_white_threshold):
+    squares = cached_candidate_squares(image_key, threshold, min_area, img)
+    return rank_candidates(squares, cached_scorer(image_key, img), avg_white_threshold=avg_white_threshold)
+
+
+def main():
+    st.title("二维码自动叠加")
+
+    # 批量模式：同一个二维码叠加到多张背景上，结果打包下载
+    batch_mode = st.checkbox("批量模式")
+    if batch_mode:
+        bg_img_files = st.file_uploader("请选择背景图片（可以多选）", type=["jpg", "jpeg", "png"],
+                                        accept_multiple_files=True)
     else:
-        st.warning("未找到空白区域。")
+        bg_img_file = st.file_uploader("请选择背景图片", type=["jpg", "jpeg", "png"])
+    fg_img_file = st.file_uploader("请选择二维码图片", type=["jpg", "jpeg", "png"])
+    # 金字塔模式：先在缩小的图像上粗定位，再在原始分辨率上精确求解，适合大尺寸海报
+    use_pyramid = st.checkbox("金字塔加速", value=True)
+
+    if batch_mode:
+        workers = st.number_input("并行进程数", min_value=1, max_value=64, value=os.cpu_count() or 1)
+        if bg_img_files and fg_img_file is not None and st.button("开始批量叠加"):
+            stamp_uploads(bg_img_files, fg_img_file, workers, use_pyramid)
+        return
+
+    # 列出多个候选位置，可以在不重新检测的情况下换一个位置
+    show_candidates = st.checkbox("显示候选位置")
+    show_contours = st.checkbox("显示轮廓（调试）")
+
+    with st.expander("检测参数"):
+        threshold = st.slider("空白阈值", 0, 255, 250)
+        min_area = st.number_input("最小区域面积", min_value=0, max_value=10_000_000, value=1000, step=500)
+        aspect_ratio_tolerance = st.slider("宽高比容差", 0.0, 1.0, 0.2)
+        avg_white_threshold = st.slider("平均白度阈值", 0, 255, 250)
+
+    if bg_img_file is not None and fg_img_file is not None:
+        # 解码结果按内容哈希缓存，缓存中的图像是共享的，叠加前先复制
+        image_key = content_hash(bg_img_file)
+        bg_img = open_image(bg_img_file, "RGBA").copy()
+        fg_img = open_image(fg_img_file, "RGBA")
+        bg_img_cv2 = cached_bgr(image_key, bg_img)
+
+        if show_contours:
+            contours = cached_contours(image_key, threshold, bg_img_cv2)
+            st.image(draw_contours(bg_img_cv2, contours), caption="找到的轮廓", channels="BGR", use_column_width=True)
+
+        if show_candidates:
+            candidates = staged_candidates(image_key, bg_img_cv2, threshold, min_area, avg_white_threshold)
+            labels = [f"位置 {i+1}：边长 {c['rect'][2]}，均值 {c['mean']:.1f}，方差 {c['variance']:.1f}，得分 {c['score']:.0f}"
+                      for i, c in enumerate(candidates)]
+            choice = st.selectbox("选择候选位置", range(len(candidates)), format_func=labels.__getitem__)
+            blank_area = candidates[choice]["rect"] if candidates else None
+        elif use_pyramid:
+            blank_area = staged_pyramid(image_key, bg_img_cv2, threshold, min_area, aspect_ratio_tolerance,
+                                        avg_white_threshold)
+        else:
+            blank_area = staged_blank_area(image_key, bg_img_cv2, threshold, min_area,
+                                           aspect_ratio_tolerance, avg_white_threshold)
+        if blank_area:
+            x, y, w, h = blank_area
+            result_img = overlay_images(bg_img, fg_img, x, y, w, h)
+            st.image(result_img, caption="叠加后的图片", use_column_width=True)
+        else:
+            st.warning("未找到空白区域。")
+
+
+def stamp_uploads(bg_img_files, fg_img_file, workers, use_pyramid):
+    # 批处理的工作函数在单独的模块中，qr_batch 本身会导入 qr，所以在这里才导入
+    from qr_batch import stamp_batch
+
+    progress = st.progress(0.0)
+    missing = []
+    backgrounds = ((f.name, f.getvalue()) for f in bg_img_files)
+    # 每完成一张就写入临时ZIP文件，结果不在内存中堆积。
+    # download_button 不接受 TemporaryFile，写完后以 "rb" 重新打开交给它，读入后删除临时文件
+    archive = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+    try:
+        with archive, zipfile.ZipFile(archive, "w") as zip_file:
+            results = stamp_batch(backgrounds, fg_img_file.getvalue(), workers, use_pyramid)
+            for count, (name, data, blank_area) in enumerate(results, start=1):
+                if data is None:
+                    missing.append(name)
+                else:
+                    zip_file.writestr(f"{os.path.splitext(name)[0]}_qr.png", data)
+                progress.progress(count / len(bg_img_files), text=f"{count}/{len(bg_img_files)}")
+
+        if missing:
+            st.warning("以下背景未找到空白区域：" + "、".join(missing))
+        if len(missing) < len(bg_img_files):
+            with open(archive.name, "rb") as data:
+                st.download_button("下载叠加后的图片", data=data, file_name="二维码叠加.zip",
+                                   mime="application/zip", on_click="ignore")
+    finally:
+        os.remove(archive.name)
+
+if __name__ == "__main__":
+    main()
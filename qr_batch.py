@@ -0,0 +1,58 @@
+import concurrent.futures
+import functools
+import io
+import multiprocessing
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from compositor import ordered_results
+from encoders import encode_image
+from qr import find_blank_area, find_blank_area_pyramid, overlay_images, qr_size
+
+# 批量模式下每个工作进程持有一份二维码，按目标尺寸缓存缩放结果
+_batch_qr = None
+
+
+def _init_batch(qr_bytes):
+    global _batch_qr
+    _batch_qr = Image.open(io.BytesIO(qr_bytes)).convert("RGBA")
+    _resized_qr.cache_clear()
+
+
+@functools.lru_cache(maxsize=64)
+def _resized_qr(size):
+    return _batch_qr.resize(size, Image.LANCZOS)
+
+
+def stamp_background(name, data, use_pyramid=True, encoder=None):
+    """
+    在一张背景上检测空白区域并叠加二维码，返回 (name, 编码后的字节, 空白区域)；
+    没有空白区域时字节和区域为 None
+    """
+    bg_img = Image.open(io.BytesIO(data)).convert("RGBA")
+    bg_img_cv2 = cv2.cvtColor(np.array(bg_img), cv2.COLOR_RGBA2BGR)
+    blank_area = find_blank_area_pyramid(bg_img_cv2) if use_pyramid else find_blank_area(bg_img_cv2)
+    if not blank_area:
+        return name, None, None
+
+    x, y, w, h = blank_area
+    resized = _resized_qr(qr_size(_batch_qr.size, w, h))
+    result_img = overlay_images(bg_img, _batch_qr, x, y, w, h, resized)
+    result, _ = encode_image(result_img, **(encoder or {}))
+    return name, result, blank_area
+
+
+def stamp_batch(backgrounds, qr_bytes, workers=None, use_pyramid=True, encoder=None):
+    """
+    在进程池中把同一个二维码叠加到多张背景上。backgrounds 为 (name, 字节) 的可迭代对象，
+    按输入顺序逐个产出 stamp_background 的结果，同时在途的任务数有上限。
+    Streamlit 服务器是多线程的，工作进程用 spawn 启动，避免 fork 时复制其他线程持有的锁
+    """
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_init_batch, initargs=(qr_bytes,)) as executor:
+        tasks = ((name, data, use_pyramid, encoder) for name, data in backgrounds)
+        yield from ordered_results(executor, stamp_background, tasks, workers * 2)
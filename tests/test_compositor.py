@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from compositor import composite_batch
+
+
+def _png(array):
+    buffer = io.BytesIO()
+    Image.fromarray(array, "RGBA").save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def _random_rgba(rng, width, height, opaque=False):
+    array = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    # 加入完全透明和完全不透明的像素，覆盖两种特殊情况
+    array[..., 3][rng.random((height, width)) < 0.2] = 0
+    array[..., 3][rng.random((height, width)) < 0.2] = 255
+    if opaque:
+        array[..., 3] = 255
+    return array
+
+
+def _reference(backgrounds, foregrounds):
+    """
+    原有的逐张 Image.alpha_composite 实现
+    """
+    for background_array in backgrounds:
+        background = Image.fromarray(background_array, "RGBA")
+        for foreground_array in foregrounds:
+            foreground = Image.fromarray(foreground_array, "RGBA")
+            if foreground.width > background.width or foreground.height > background.height:
+                background = background.resize((foreground.width, foreground.height), Image.BICUBIC)
+            composite_image = Image.new("RGBA", background.size)
+            composite_image.paste(background, (0, 0))
+            position = ((background.width - foreground.width) // 2, (background.height - foreground.height) // 2)
+            composite_image.alpha_composite(foreground, position)
+            yield composite_image
+
+
+def _assert_same(backgrounds, foregrounds):
+    expected = list(_reference(backgrounds, foregrounds))
+    actual = list(composite_batch([_png(b) for b in backgrounds], [_png(f) for f in foregrounds]))
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        assert a.size == e.size
+        assert np.array_equal(np.asarray(a), np.asarray(e))
+
+
+def test_matches_alpha_composite_on_opaque_backgrounds():
+    rng = np.random.default_rng(0)
+    backgrounds = [_random_rgba(rng, 64, 48, opaque=True), _random_rgba(rng, 33, 71, opaque=True)]
+    foregrounds = [_random_rgba(rng, 20, 30), _random_rgba(rng, 31, 17), _random_rgba(rng, 8, 8, opaque=True)]
+    _assert_same(backgrounds, foregrounds)
+
+
+def test_matches_alpha_composite_on_transparent_backgrounds():
+    rng = np.random.default_rng(1)
+    backgrounds = [_random_rgba(rng, 50, 40), np.zeros((40, 50, 4), np.uint8)]
+    foregrounds = [_random_rgba(rng, 25, 25), _random_rgba(rng, 49, 39)]
+    _assert_same(backgrounds, foregrounds)
+
+
+def test_matches_alpha_composite_when_background_is_resized():
+    rng = np.random.default_rng(2)
+    backgrounds = [_random_rgba(rng, 30, 30, opaque=True), _random_rgba(rng, 30, 30)]
+    # 第二个前景比背景大，背景被放大后继续用于第三个前景
+    foregrounds = [_random_rgba(rng, 12, 12), _random_rgba(rng, 45, 28), _random_rgba(rng, 21, 9)]
+    _assert_same(backgrounds, foregrounds)
+
+
+def test_fully_transparent_foreground_keeps_background():
+    rng = np.random.default_rng(3)
+    backgrounds = [_random_rgba(rng, 16, 16)]
+    foregrounds = [np.zeros((10, 10, 4), np.uint8)]
+    _assert_same(backgrounds, foregrounds)
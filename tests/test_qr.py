@@ -0,0 +1,48 @@
+import numpy as np
+
+from qr import largest_square, square_map
+
+
+def _brute_force_side(mask):
+    """
+    枚举所有位置和边长，求全为真的最大正方形边长
+    """
+    height, width = mask.shape
+    best = 0
+    for y in range(height):
+        for x in range(width):
+            side = best + 1
+            while y + side <= height and x + side <= width:
+                if mask[y:y + side, x:x + side].all():
+                    best = side
+                side += 1
+    return best
+
+
+def test_largest_square_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        height, width = rng.integers(1, 14, size=2)
+        mask = rng.random((height, width)) < rng.uniform(0.5, 1.0)
+        x, y, side = largest_square(mask)
+        assert side == _brute_force_side(mask)
+        if side:
+            assert mask[y:y + side, x:x + side].all()
+
+
+def test_square_map_matches_brute_force():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        height, width = rng.integers(1, 10, size=2)
+        mask = rng.random((height, width)) < 0.8
+        dp = square_map(mask)
+        for i in range(height):
+            for j in range(width):
+                side = 0
+                while side < min(i, j) + 1 and mask[i - side:i + 1, j - side:j + 1].all():
+                    side += 1
+                assert dp[i, j] == side
+
+
+def test_largest_square_empty_mask():
+    assert largest_square(np.zeros((5, 7), bool)) == (0, 0, 0)